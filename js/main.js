@@ -227,6 +227,7 @@
 
     var pickerOverlay, pickerImage, pickerCrosshair, pickerCoords, pickerCancel, pickerViewport;
     var pickerCompW = 0, pickerCompH = 0;
+    var pickerFrameIndex = 0;
     var pickerCleanup = null;
 
     function onPickPoint() {
@@ -252,19 +253,21 @@
                     return;
                 }
 
-                /* Update comp state from fresh data */
-                comp = {
-                    name: comp ? comp.name : "\u2014",
-                    width: data.compWidth,
-                    height: data.compHeight,
-                    fps: data.fps,
-                    totalFrames: data.totalFrames,
-                    currentTime: 0
-                };
+                /* Update comp state from fresh data, keeping every field
+                   st_getCompInfo() set (the frame cache key uses them) */
+                comp = comp || { currentTime: 0 };
+                comp.name        = data.name || comp.name || "\u2014";
+                comp.width       = data.compWidth;
+                comp.height      = data.compHeight;
+                comp.fps         = data.fps;
+                comp.duration    = data.duration;
+                comp.totalFrames = data.totalFrames;
+                comp.pixelAspect = data.pixelAspect;
                 setCompState(comp);
 
                 pickerCompW = data.compWidth;
                 pickerCompH = data.compHeight;
+                pickerFrameIndex = data.frameIndex || 0;
 
                 setStatus("PICK POINT\u2026", "processing");
                 log("frame ready \u2014 click on the object");
@@ -524,7 +527,7 @@
             cleanup();
 
             /* Add the tracked point, enriched with preview data if available */
-            var obj = { id: nextId, x: x, y: y };
+            var obj = { id: nextId, x: x, y: y, frameIndex: pickerFrameIndex };
             if (previewResult) {
                 obj.bbox     = previewResult.bbox;
                 obj.polygon  = previewResult.polygon;
@@ -536,7 +539,7 @@
             renderObjectList();
             updateButtons();
             finishPick();
-            log("point_" + pad2(obj.id) + " \u2192 (" + pad4(obj.x) + ", " + pad4(obj.y) + ")");
+            log("point_" + pad2(obj.id) + " \u2192 (" + pad4(obj.x) + ", " + pad4(obj.y) + ") @ frame " + obj.frameIndex);
         }
 
         function onMouseMove(evt) {
@@ -630,22 +633,41 @@
         showProgress(true);
         updateProgress(0, 0);
 
-        var framesFolder = (tempFolder + "/frames").replace(/\\/g, "/");
+        var cacheRoot = (tempFolder + "/frames").replace(/\\/g, "/");
+        var cacheParams = {
+            comp:        comp.name,
+            width:       comp.width,
+            height:      comp.height,
+            fps:         comp.fps,
+            duration:    comp.duration,
+            totalFrames: comp.totalFrames,
+            pixelAspect: comp.pixelAspect,
+            format:      "png"
+        };
 
-        /* Check if frames are already exported (skip re-render) */
-        var cachedFrames = getCachedFrameCount(framesFolder);
-        var expectedFrames = comp ? comp.totalFrames : 0;
+        /* Ask the frame cache index whether this comp's frames are still valid (skip re-render) */
+        runCacheCommand({
+            action: "validate",
+            cache_dir: cacheRoot,
+            cache_params: cacheParams,
+            expected_frames: comp.totalFrames
+        }, function (res) {
+            if (!tracking) { return; }
+
+            if (res && res.status === "VALID") {
+                log("using cached frames (skipping render)");
+                startPythonTracking({
+                    framesDir:  res.framesDir,
+                    compWidth:  comp.width,
+                    compHeight: comp.height,
+                    fps:        comp.fps
+                });
+                return;
+            }
+
+            var framesFolder = res ? res.framesDir : cacheRoot;
+            if (res && res.reason) { log("frame cache: " + res.reason); }
 
-        if (cachedFrames > 0 && cachedFrames >= expectedFrames && expectedFrames > 0) {
-            log("using " + cachedFrames + " cached frames (skipping render)");
-            startPythonTracking({
-                framesDir:  framesFolder,
-                numFrames:  cachedFrames,
-                compWidth:  comp.width,
-                compHeight: comp.height,
-                fps:        comp.fps
-            });
-        } else {
             setStatus("EXPORTING FRAMES\u2026", "processing");
             log("exporting all frames\u2026");
 
@@ -668,23 +690,70 @@
                 }
 
                 log("exported " + data.numFrames + " frames to " + data.framesDir);
-                startPythonTracking(data);
+                if (!res) {
+                    startPythonTracking(data);
+                    return;
+                }
+
+                /* Record the new frame set's hashes, evicting old shots over budget */
+                runCacheCommand({
+                    action: "commit",
+                    cache_dir: cacheRoot,
+                    cache_params: cacheParams
+                }, function () {
+                    if (tracking) { startPythonTracking(data); }
+                });
             });
-        }
+        });
     }
 
-    /* Count existing frame PNGs in directory */
-    function getCachedFrameCount(framesFolder) {
-        try {
-            var files = fs.readdirSync(framesFolder);
-            var count = 0;
-            for (var i = 0; i < files.length; i++) {
-                if (files[i].indexOf("st_frame_") === 0) { count++; }
+    /*
+     * Run supertracery.py in cache mode (venv python, then python3, then python).
+     * Calls back with { status, framesDir, reason } parsed from CACHE:<status>:<dir>,
+     * or null if Python could not be started.
+     */
+    function runCacheCommand(options, callback) {
+        var scriptPath = extPath + "/python/supertracery.py";
+        var config = { mode: "cache" };
+        for (var k in options) {
+            if (options.hasOwnProperty(k)) { config[k] = options[k]; }
+        }
+        var configStr = JSON.stringify(config);
+        var candidates = [extPath + "/python/venv/bin/python3", "python3", "python"];
+
+        function attempt(n) {
+            if (n >= candidates.length) { callback(null); return; }
+
+            var proc;
+            try {
+                proc = childProcess.spawn(candidates[n], [scriptPath, configStr], {
+                    cwd: extPath + "/python"
+                });
+            } catch (spawnErr) {
+                attempt(n + 1);
+                return;
             }
-            return count;
-        } catch (e) {
-            return 0; // folder doesn't exist
+
+            var failed = false;
+            var out = "";
+            proc.on("error", function () {
+                if (failed) { return; }
+                failed = true;
+                attempt(n + 1);
+            });
+            proc.stdout.on("data", function (chunk) { out += chunk.toString(); });
+            proc.on("close", function () {
+                if (failed) { return; }
+                var reasonMatch = out.match(/^INFO:Frame cache miss \((.*)\)$/m);
+                var m = out.match(/^CACHE:(VALID|STALE|SAVED|CLEARED):(.*)$/m);
+                callback(m ? {
+                    status:    m[1],
+                    framesDir: m[2].trim(),
+                    reason:    reasonMatch ? reasonMatch[1] : ""
+                } : null);
+            });
         }
+        attempt(0);
     }
 
     /* Launch Python tracker with exported frame data */
@@ -694,7 +763,8 @@
             clickPoints.push({
                 x: objects[i].x,
                 y: objects[i].y,
-                object_id: objects[i].id
+                object_id: objects[i].id,
+                frame_index: objects[i].frameIndex || 0
             });
         }
 
@@ -1200,17 +1270,11 @@
     }
 
     function clearCachedFrames() {
-        if (!fs) { return; }
-        var framesFolder = (tempFolder + "/frames").replace(/\\/g, "/");
-        try {
-            var files = fs.readdirSync(framesFolder);
-            for (var i = 0; i < files.length; i++) {
-                try { fs.unlinkSync(framesFolder + "/" + files[i]); } catch (e) {}
-            }
-            log("cleared cached frames");
-        } catch (e) {
-            // folder doesn't exist, nothing to clear
-        }
+        if (!fs || !childProcess) { return; }
+        var cacheRoot = (tempFolder + "/frames").replace(/\\/g, "/");
+        runCacheCommand({ action: "clear", cache_dir: cacheRoot }, function (res) {
+            if (res) { log("cleared cached frames"); }
+        });
     }
 
     /* ── Button state ──────────────────────────────────────── */
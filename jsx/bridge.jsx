@@ -200,7 +200,9 @@ function st_exportPickerFrame(outputFolder) {
             ',"compHeight":' + comp.height +
             ',"fps":' + comp.frameRate +
             ',"totalFrames":' + Math.round(comp.duration * comp.frameRate) +
-            ',"duration":' + comp.duration + '}';
+            ',"duration":' + comp.duration +
+            ',"pixelAspect":' + comp.pixelAspect +
+            ',"name":' + JSON.stringify(comp.name) + '}';
 
     } catch (e) {
         result = '{"error":' + JSON.stringify(e.toString()) + '}';
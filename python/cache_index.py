@@ -0,0 +1,181 @@
+"""
+SuperTracery - Frame Cache Index
+Manifest of exported frame sets, one per comp and render settings.
+Validates cached frames against recorded sizes, mtimes and content hashes,
+and evicts least-recently-used frame sets under a global disk budget.
+"""
+
+import os
+import json
+import time
+import glob
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from frames import STORE_NAME
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Default disk budget for all cached frame sets, in megabytes
+DEFAULT_BUDGET_MB = 20 * 1024
+
+
+def cache_key(params):
+    """Stable key for a comp + render settings dict."""
+    blob = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def _file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _frame_files(frames_dir):
+    # Same prefix match as the panel and the AE export (numbers may follow the extension)
+    return sorted(p for p in glob.glob(os.path.join(frames_dir, "st_frame_*")) if os.path.isfile(p))
+
+
+class FrameCacheIndex(object):
+    """
+    Manifest of frame sets under cache_root/<key>/.
+    Each set records per-frame name, size, mtime and content hash, the frame
+    store built from it if any, its total size and when it was last used.
+    """
+
+    def __init__(self, cache_root):
+        self.cache_root = cache_root
+        self.manifest_path = os.path.join(cache_root, MANIFEST_NAME)
+        self.sets = {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.sets = manifest.get("sets", {})
+        except (OSError, ValueError):
+            pass
+
+    def frames_dir(self, key):
+        return os.path.join(self.cache_root, key)
+
+    def validate(self, key, expected_frames=None):
+        """
+        Check a frame set against the manifest.
+        Size and mtime are compared first; a frame whose mtime changed is
+        re-hashed and only counts as stale if its content differs.
+        Returns (ok, reason).
+        """
+        entry = self.sets.get(key)
+        if entry is None:
+            return False, "not cached"
+        if expected_frames and len(entry["frames"]) < expected_frames:
+            return False, "incomplete ({} of {} frames)".format(len(entry["frames"]), expected_frames)
+
+        frames_dir = self.frames_dir(key)
+        if len(_frame_files(frames_dir)) != len(entry["frames"]):
+            return False, "frame count changed"
+
+        for record in entry["frames"]:
+            path = os.path.join(frames_dir, record["name"])
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False, "missing " + record["name"]
+            if st.st_size == record["size"] and st.st_mtime_ns == record["mtime_ns"]:
+                continue
+            if st.st_size != record["size"] or _file_hash(path) != record["hash"]:
+                return False, "changed " + record["name"]
+            record["mtime_ns"] = st.st_mtime_ns
+
+        return True, "ok"
+
+    def commit(self, key, params, workers=None):
+        """Hash a freshly exported frame set and record it in the manifest."""
+        paths = _frame_files(self.frames_dir(key))
+        workers = int(workers or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = list(pool.map(_file_hash, paths))
+
+        frames = []
+        for path, digest in zip(paths, hashes):
+            st = os.stat(path)
+            frames.append({
+                "name": os.path.basename(path),
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "hash": digest
+            })
+
+        entry = {
+            "params": params,
+            "frames": frames,
+            "last_used": time.time()
+        }
+        self.sets[key] = entry
+        # A store left from an earlier export still takes disk until it is rebuilt
+        self._count_store(key)
+        return entry
+
+    def record_store(self, key, store_path):
+        """Count a frame store built inside a cached frame set toward its size. False if key is not cached."""
+        if key not in self.sets:
+            return False
+        if os.path.dirname(os.path.abspath(store_path)) != os.path.abspath(self.frames_dir(key)):
+            return False
+        self._count_store(key)
+        return True
+
+    def _count_store(self, key):
+        entry = self.sets[key]
+        entry.pop("store", None)
+        try:
+            entry["store"] = {"name": STORE_NAME,
+                              "size": os.path.getsize(os.path.join(self.frames_dir(key), STORE_NAME))}
+        except OSError:
+            pass
+        entry["bytes"] = sum(f["size"] for f in entry["frames"]) + entry.get("store", {}).get("size", 0)
+
+    def touch(self, key):
+        if key in self.sets:
+            self.sets[key]["last_used"] = time.time()
+
+    def remove(self, key):
+        """Drop a frame set from the manifest and delete its files, frame store included."""
+        self.sets.pop(key, None)
+        shutil.rmtree(self.frames_dir(key), ignore_errors=True)
+
+    def evict(self, budget_bytes, keep=()):
+        """Delete least-recently-used sets until the total fits budget_bytes."""
+        total = sum(entry["bytes"] for entry in self.sets.values())
+        removed = []
+        for key in sorted(self.sets, key=lambda k: self.sets[k]["last_used"]):
+            if total <= budget_bytes:
+                break
+            if key in keep:
+                continue
+            total -= self.sets[key]["bytes"]
+            self.remove(key)
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        """Delete every frame set, plus loose frames and store left by the old flat layout."""
+        for key in list(self.sets):
+            self.remove(key)
+        for path in _frame_files(self.cache_root) + [os.path.join(self.cache_root, STORE_NAME)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def save(self):
+        os.makedirs(self.cache_root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "sets": self.sets}, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
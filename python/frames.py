@@ -0,0 +1,542 @@
+"""
+SuperTracery - Frame I/O
+Frame sources (PNG sequence, memory-mapped frame store, video container) and
+the decoded-frame cache shared by segmentation, propagation and analysis.
+"""
+
+import os
+import struct
+import bisect
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import cv2
+
+# Default budget for decoded frames (BGR + luma planes), in megabytes
+DEFAULT_CACHE_MB = 1024
+
+# Default number of frames decoded ahead of the consumer
+DEFAULT_PREFETCH_DEPTH = 4
+
+# Forward gaps up to this many frames are skipped by decoding, not seeking
+_MAX_GRAB_GAP = 16
+
+# Raw frame store written next to the PNG sequence
+STORE_NAME = "st_frames.store"
+_STORE_MAGIC = b"STFRAMES"
+_STORE_VERSION = 1
+# magic, version, frame count, height, width, channels, source signature
+_STORE_HEADER = struct.Struct("<8sIIIII32s")
+_STORE_HEADER_SIZE = 64
+
+# Module-level shared cache
+_frame_cache = None
+
+
+class FrameCache(object):
+    """
+    Bounded LRU cache of decoded frames.
+    Each entry keeps the BGR image and its luma plane together, so a frame
+    needed in colour by segmentation and in grayscale by optical flow and
+    analysis is only decoded once. Cached arrays are read-only.
+    Thread-safe; decoding happens outside the lock so prefetch threads
+    decode in parallel.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = int(budget_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load=None):
+        """
+        Return (bgr, luma) for key, decoding on a miss.
+        load: callable key -> BGR image; defaults to cv2.imread on a path.
+        Returns (None, None) if the frame can't be read.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        bgr = load(key) if load is not None else cv2.imread(key)
+        if bgr is None:
+            return None, None
+
+        luma = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        bgr.flags.writeable = False
+        luma.flags.writeable = False
+        entry = (bgr, luma)
+        # Memory-mapped views cost no heap, only the luma plane counts
+        nbytes = luma.nbytes if isinstance(bgr, np.memmap) else bgr.nbytes + luma.nbytes
+        with self._lock:
+            self._insert(key, entry, nbytes)
+        return entry
+
+    def _insert(self, key, entry, nbytes):
+        if nbytes > self.budget_bytes or key in self._entries:
+            return  # larger than the whole budget, or decoded concurrently
+        while self._entries and self._bytes + nbytes > self.budget_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+        self._entries[key] = entry
+        self._sizes[key] = nbytes
+        self._bytes += nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._bytes
+        }
+
+
+def get_frame_cache():
+    """Return the shared frame cache, creating it with the default budget."""
+    global _frame_cache
+    if _frame_cache is None:
+        _frame_cache = FrameCache(DEFAULT_CACHE_MB * 1024 * 1024)
+    return _frame_cache
+
+
+def configure_frame_cache(budget_mb):
+    """Replace the shared frame cache with one of the given budget (MB)."""
+    global _frame_cache
+    _frame_cache = FrameCache(float(budget_mb) * 1024 * 1024)
+    return _frame_cache
+
+
+def prefetch(frames, indices=None, depth=DEFAULT_PREFETCH_DEPTH):
+    """
+    Iterate (idx, bgr, luma) over a frame source in order, decoding up to
+    depth frames ahead on a thread pool while the caller works on the
+    current one. OpenCV releases the GIL while decoding, so the threads
+    overlap. depth <= 0 decodes synchronously.
+    """
+    if indices is None:
+        indices = range(len(frames))
+
+    def load(idx):
+        return idx, frames.bgr(idx), frames.luma(idx)
+
+    if depth <= 0:
+        for idx in indices:
+            yield load(idx)
+        return
+
+    pending = deque()
+    remaining = iter(indices)
+    with ThreadPoolExecutor(max_workers=min(depth, os.cpu_count() or 1)) as pool:
+        for idx in remaining:
+            pending.append(pool.submit(load, idx))
+            if len(pending) >= depth:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for idx in remaining:
+                pending.append(pool.submit(load, idx))
+                break
+            yield result
+
+
+def find_held_frames(frames, workers=None):
+    """
+    Find runs of consecutive identical frames (held frames, pulldown).
+    Frames are fingerprinted on a thread pool; a fingerprint match is then
+    verified pixel-for-pixel so a hash collision can never merge frames.
+    Returns, for each frame, the index of the first frame of its run.
+    """
+    workers = int(workers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(frames.fingerprint, range(len(frames))))
+
+    held = list(range(len(frames)))
+    for idx in range(1, len(frames)):
+        if digests[idx] != digests[idx - 1]:
+            continue
+        first = held[idx - 1]
+        if np.array_equal(frames.bgr(first), frames.bgr(idx)):
+            held[idx] = first
+    return held
+
+
+class ImageSequence(object):
+    """Frames backed by an image sequence on disk, decoded through the shared cache."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def shape(self):
+        return self.bgr(0).shape[:2]
+
+    def fingerprint(self, idx):
+        # Hash the encoded file, no decode needed
+        with open(self.paths[idx], "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).digest()
+
+    def bgr(self, idx):
+        return get_frame_cache().get(self.paths[idx])[0]
+
+    def luma(self, idx):
+        return get_frame_cache().get(self.paths[idx])[1]
+
+
+class FrameStore(object):
+    """
+    Memory-mapped uint8 frame store: a small header followed by all frames
+    as one contiguous (count, H, W, C) array. bgr() returns zero-copy views.
+    paths keeps the source sequence the store was built from.
+    """
+
+    def __init__(self, store_path, paths=None):
+        with open(store_path, "rb") as f:
+            header = f.read(_STORE_HEADER_SIZE)
+        if len(header) < _STORE_HEADER_SIZE:
+            raise ValueError("Truncated frame store: " + store_path)
+
+        magic, version, count, h, w, c, signature = _STORE_HEADER.unpack(header[:_STORE_HEADER.size])
+        if magic != _STORE_MAGIC or version != _STORE_VERSION:
+            raise ValueError("Not a frame store: " + store_path)
+
+        expected = _STORE_HEADER_SIZE + count * h * w * c
+        if os.path.getsize(store_path) != expected:
+            raise ValueError("Incomplete frame store: " + store_path)
+
+        self.store_path = store_path
+        self.signature = signature
+        self.paths = list(paths) if paths is not None else []
+        self._layout = (count, h, w, c)
+        self._data = self._map()
+
+    def _map(self, mode="r"):
+        return np.memmap(self.store_path, dtype=np.uint8, mode=mode,
+                         offset=_STORE_HEADER_SIZE, shape=self._layout)
+
+    def __getstate__(self):
+        # Re-map in the receiving process instead of pickling the frames
+        state = self.__dict__.copy()
+        del state["_data"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = self._map()
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    @property
+    def shape(self):
+        return self._data.shape[1:3]
+
+    def fingerprint(self, idx):
+        return hashlib.blake2b(self._data[idx], digest_size=16).digest()
+
+    def bgr(self, idx):
+        return self._data[idx]
+
+    def luma(self, idx):
+        return get_frame_cache().get((self.store_path, idx), self._view)[1]
+
+    def _view(self, key):
+        return self._data[key[1]]
+
+
+class VideoFrames(object):
+    """
+    Frames decoded straight from a video container (mp4/mov/mkv) through
+    cv2.VideoCapture, with no intermediate image files. Sequential reads
+    stream and short forward gaps (strided tracking) are decoded through;
+    anything else seeks, so a sub-range only decodes the frames it covers.
+    """
+
+    def __init__(self, video_path):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError("Could not open video: " + video_path)
+
+        self.video_path = video_path
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        self._count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._cap = cap
+        self._pos = 0  # next frame the capture will return
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Captures can't be pickled; the receiving process reopens the file
+        state = self.__dict__.copy()
+        del state["_cap"]
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cap = cv2.VideoCapture(self.video_path)
+        self._pos = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def fingerprint(self, idx):
+        return hashlib.blake2b(self.bgr(idx), digest_size=16).digest()
+
+    def bgr(self, idx):
+        return get_frame_cache().get((self.video_path, idx), self._decode)[0]
+
+    def luma(self, idx):
+        return get_frame_cache().get((self.video_path, idx), self._decode)[1]
+
+    def _decode(self, key):
+        pos = key[1]
+        # One capture, decoded in order; prefetch threads take turns
+        with self._lock:
+            if 0 <= self._pos < pos <= self._pos + _MAX_GRAB_GAP:
+                while self._pos < pos and self._cap.grab():
+                    self._pos += 1
+            if pos != self._pos:
+                self._seek(pos)
+            ok, image = self._cap.read()
+            self._pos = pos + 1 if ok else -1
+        return image if ok else None
+
+    def _seek(self, pos):
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
+        if int(self._cap.get(cv2.CAP_PROP_POS_FRAMES)) != pos:
+            # Backend couldn't land on the exact frame: reopen and step forward
+            self._cap.release()
+            self._cap = cv2.VideoCapture(self.video_path)
+            for _ in range(pos):
+                self._cap.grab()
+
+
+class FrameSubset(object):
+    """
+    View of a frame source restricted to a list of source indices, e.g. a
+    work-area range sampled every Nth frame. Local index i maps to source
+    frame indices[i]; shape is the source shape.
+    """
+
+    def __init__(self, frames, indices):
+        self.frames = frames
+        self.indices = list(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def shape(self):
+        return self.frames.shape
+
+    def source_index(self, idx):
+        return self.indices[idx]
+
+    def local_index(self, source_idx):
+        """Local index of the subset frame nearest to a source frame index."""
+        pos = bisect.bisect_left(self.indices, source_idx)
+        if pos == len(self.indices):
+            return pos - 1
+        if pos > 0 and source_idx - self.indices[pos - 1] <= self.indices[pos] - source_idx:
+            return pos - 1
+        return pos
+
+    def fingerprint(self, idx):
+        return self.frames.fingerprint(self.indices[idx])
+
+    def bgr(self, idx):
+        return self.frames.bgr(self.indices[idx])
+
+    def luma(self, idx):
+        return self.frames.luma(self.indices[idx])
+
+
+class ScaledFrames(object):
+    """
+    Frame source downsampled by a proxy factor (e.g. 0.5 or 0.25) before
+    segmentation and propagation. Coordinates measured on these frames are
+    proxy pixels; divide by scale to get back to comp space.
+    """
+
+    def __init__(self, frames, scale):
+        self.frames = frames
+        self.scale = float(scale)
+        h, w = frames.shape
+        self.shape = (max(1, int(round(h * self.scale))), max(1, int(round(w * self.scale))))
+        self._key = ("proxy", id(frames), self.scale)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def fingerprint(self, idx):
+        # Identical sources downsample identically
+        return self.frames.fingerprint(idx)
+
+    def bgr(self, idx):
+        return get_frame_cache().get((self._key, idx), self._resize)[0]
+
+    def luma(self, idx):
+        return get_frame_cache().get((self._key, idx), self._resize)[1]
+
+    def _resize(self, key):
+        image = self.frames.bgr(key[1])
+        if image is None:
+            return None
+        return cv2.resize(image, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+
+
+class StagedFrames(FrameStore):
+    """
+    Frames pre-resized to model resolution by stage_frames().
+    bgr() returns model-resolution views, while shape stays the source
+    (comp) size; scale maps staged pixel coordinates back to comp space.
+    """
+
+    def __init__(self, store_path, source_shape):
+        FrameStore.__init__(self, store_path)
+        self.source_shape = tuple(source_shape)
+
+    @property
+    def shape(self):
+        return self.source_shape
+
+    @property
+    def scale(self):
+        """(sx, sy) multipliers from staged to comp pixel coordinates."""
+        return (self.source_shape[1] / float(self._layout[2]),
+                self.source_shape[0] / float(self._layout[1]))
+
+    def remove(self):
+        """Delete the staged store and its temp directory."""
+        self._data = None
+        shutil.rmtree(os.path.dirname(self.store_path), ignore_errors=True)
+
+
+def _stage_chunk(frames, store_path, indices, size):
+    """Process-pool worker: resize a run of frames into the staged store."""
+    count = len(frames)
+    out = np.memmap(store_path, dtype=np.uint8, mode="r+",
+                    offset=_STORE_HEADER_SIZE, shape=(count, size, size, 3))
+    for idx in indices:
+        out[idx] = cv2.resize(frames.bgr(idx), (size, size), interpolation=cv2.INTER_AREA)
+    out.flush()
+    return len(indices)
+
+
+def stage_frames(frames, size, workers=None):
+    """
+    Write every frame pre-resized to size x size (the model input) into a
+    temporary frame store, using a process pool. Workers decode without
+    caching and write straight into the shared memory-mapped file.
+    Returns StagedFrames; call remove() when done.
+    """
+    count = len(frames)
+    stage_dir = tempfile.mkdtemp(prefix="st_stage_")
+    store_path = os.path.join(stage_dir, STORE_NAME)
+    with open(store_path, "wb") as f:
+        header = _STORE_HEADER.pack(_STORE_MAGIC, _STORE_VERSION, count, size, size, 3, b"")
+        f.write(header.ljust(_STORE_HEADER_SIZE, b"\0"))
+        f.truncate(_STORE_HEADER_SIZE + count * size * size * 3)
+
+    workers = int(workers or os.cpu_count() or 1)
+    # Contiguous runs keep video workers decoding sequentially
+    run = max(1, -(-count // (workers * 4)))
+    chunks = [range(i, min(i + run, count)) for i in range(0, count, run)]
+
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_frame_cache,
+                                 initargs=(0,)) as pool:
+            futures = [pool.submit(_stage_chunk, frames, store_path, chunk, size) for chunk in chunks]
+            for future in futures:
+                done += future.result()
+                print("PROGRESS:{}/{}".format(done, count), flush=True)
+    except Exception:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        raise
+
+    print("INFO:Staged {} frames at {}x{} with {} workers".format(count, size, size, workers), flush=True)
+    return StagedFrames(store_path, frames.shape)
+
+
+def _source_signature(paths):
+    """Digest of names, sizes and mtimes of the source frames."""
+    digest = hashlib.sha256()
+    for path in paths:
+        st = os.stat(path)
+        digest.update("{}|{}|{}\n".format(os.path.basename(path), st.st_size, st.st_mtime_ns).encode("utf-8"))
+    return digest.digest()
+
+
+def build_frame_store(paths, store_path):
+    """
+    Decode a frame sequence once and pack it into a memory-mapped frame store.
+    All frames must share the same shape. Written atomically via a temp file.
+    """
+    first = cv2.imread(paths[0])
+    if first is None:
+        raise ValueError("Could not read frame: " + paths[0])
+    h, w = first.shape[:2]
+    c = first.shape[2] if first.ndim == 3 else 1
+
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        header = _STORE_HEADER.pack(_STORE_MAGIC, _STORE_VERSION, len(paths), h, w, c,
+                                    _source_signature(paths))
+        f.write(header.ljust(_STORE_HEADER_SIZE, b"\0"))
+
+        for i, path in enumerate(paths):
+            image = first if i == 0 else cv2.imread(path)
+            if image is None or image.shape != first.shape:
+                f.close()
+                os.remove(tmp_path)
+                raise ValueError("Frame missing or shape mismatch: " + path)
+            f.write(np.ascontiguousarray(image).tobytes())
+            if i % 10 == 0:
+                print("PROGRESS:{}/{}".format(i + 1, len(paths)), flush=True)
+
+    os.replace(tmp_path, store_path)
+    return FrameStore(store_path, paths)
+
+
+def open_frame_store(frames_dir, paths):
+    """
+    Return the frame store for a sequence, building it if missing or stale.
+    A store is reused when its source signature matches the current frames,
+    so re-runs on the same shot skip PNG decoding entirely.
+    """
+    store_path = os.path.join(frames_dir, STORE_NAME)
+    if os.path.isfile(store_path):
+        try:
+            store = FrameStore(store_path, paths)
+            if len(store) == len(paths) and store.signature == _source_signature(paths):
+                print("INFO:Using frame store {}".format(store_path), flush=True)
+                return store
+        except ValueError:
+            pass
+
+    print("INFO:Building frame store for {} frames...".format(len(paths)), flush=True)
+    return build_frame_store(paths, store_path)
@@ -0,0 +1,105 @@
+"""
+SuperTracery - Mask Storage
+Compact binary masks: a bounding-box crop of the frame with a bit-packed
+payload, so kept masks cost a few KB instead of a full H x W byte plane.
+"""
+
+import numpy as np
+
+
+class PackedMask(object):
+    """
+    Binary mask stored as its bounding-box crop, packed 8 pixels per byte.
+    shape: (h, w) of the full frame
+    bbox:  (x0, y0, x1, y1) of the crop, x1/y1 exclusive; empty masks have a
+           zero-sized bbox
+    outline: optional simplified polygon, used instead of tracing the crop
+    """
+
+    __slots__ = ("shape", "bbox", "area", "_bits", "_centroid", "outline")
+
+    def __init__(self, shape, bbox, bits, area, centroid=None):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.bbox = tuple(int(v) for v in bbox)
+        self.area = int(area)
+        self._bits = bits
+        # Known up front when the mask was measured before packing
+        self._centroid = centroid
+        # Simplified [[x, y]] polygon when the tracker traced one from model logits
+        self.outline = None
+
+    @classmethod
+    def from_dense(cls, mask):
+        """Pack a full-frame mask (any dtype, nonzero = inside)."""
+        mask = np.asarray(mask)
+        binary = mask > 0
+        rows = np.flatnonzero(binary.any(axis=1))
+        if len(rows) == 0:
+            return cls.empty(mask.shape[:2])
+        cols = np.flatnonzero(binary.any(axis=0))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        crop = binary[y0:y1, x0:x1]
+        return cls(mask.shape[:2], (x0, y0, x1, y1), np.packbits(crop, axis=None), np.count_nonzero(crop))
+
+    @classmethod
+    def from_crop(cls, crop, origin, shape):
+        """Pack a mask given only for a crop whose top-left corner is origin (x, y) of a shape frame."""
+        packed = cls.from_dense(crop)
+        if not packed.area:
+            return cls.empty(shape)
+        ox, oy = int(origin[0]), int(origin[1])
+        x0, y0, x1, y1 = packed.bbox
+        return cls(shape, (x0 + ox, y0 + oy, x1 + ox, y1 + oy), packed._bits, packed.area)
+
+    @classmethod
+    def empty(cls, shape):
+        return cls(shape, (0, 0, 0, 0), np.zeros(0, dtype=np.uint8), 0)
+
+    @property
+    def nbytes(self):
+        return self._bits.nbytes
+
+    def crop(self):
+        """uint8 0/1 mask of the bbox region."""
+        x0, y0, x1, y1 = self.bbox
+        h, w = y1 - y0, x1 - x0
+        if h == 0 or w == 0:
+            return np.zeros((0, 0), dtype=np.uint8)
+        return np.unpackbits(self._bits, count=h * w).reshape(h, w)
+
+    def decode(self):
+        """Full-frame uint8 0/1 mask."""
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        if self.area:
+            x0, y0, x1, y1 = self.bbox
+            mask[y0:y1, x0:x1] = self.crop()
+        return mask
+
+    def centroid(self):
+        """(cx, cy) in frame pixels, or None for an empty mask."""
+        if not self.area:
+            return None
+        if self._centroid is not None:
+            return self._centroid
+        crop = self.crop()
+        x0, y0 = self.bbox[:2]
+        cx = np.dot(crop.sum(axis=0, dtype=np.int64), np.arange(crop.shape[1])) / float(self.area)
+        cy = np.dot(crop.sum(axis=1, dtype=np.int64), np.arange(crop.shape[0])) / float(self.area)
+        return cx + x0, cy + y0
+
+    def iou(self, other):
+        """Intersection over union with another PackedMask of the same frame."""
+        union_area = self.area + other.area
+        if union_area == 0:
+            return 1.0
+        ax0, ay0, ax1, ay1 = self.bbox
+        bx0, by0, bx1, by1 = other.bbox
+        x0, y0 = max(ax0, bx0), max(ay0, by0)
+        x1, y1 = min(ax1, bx1), min(ay1, by1)
+        if x1 <= x0 or y1 <= y0:
+            return 0.0
+        a = self.crop()[y0 - ay0:y1 - ay0, x0 - ax0:x1 - ax0]
+        b = other.crop()[y0 - by0:y1 - by0, x0 - bx0:x1 - bx0]
+        inter = int(np.count_nonzero(a & b))
+        return inter / float(union_area - inter)
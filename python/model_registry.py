@@ -0,0 +1,116 @@
+"""
+SuperTracery - Model Registry
+SAM2 variants resolved to local checkpoints, so model startup never waits on
+the network unless a download is allowed and actually needed, plus a
+per-checkpoint directory for derived build artifacts (compile caches,
+exported graphs).
+"""
+
+import os
+import hashlib
+
+# variant -> (SAM2 config, checkpoint file, Hugging Face repo)
+MODEL_VARIANTS = {
+    "tiny": ("configs/sam2.1/sam2.1_hiera_t.yaml", "sam2.1_hiera_tiny.pt", "facebook/sam2.1-hiera-tiny"),
+    "small": ("configs/sam2.1/sam2.1_hiera_s.yaml", "sam2.1_hiera_small.pt", "facebook/sam2.1-hiera-small"),
+    "base_plus": ("configs/sam2.1/sam2.1_hiera_b+.yaml", "sam2.1_hiera_base_plus.pt",
+                  "facebook/sam2.1-hiera-base-plus"),
+    "large": ("configs/sam2.1/sam2.1_hiera_l.yaml", "sam2.1_hiera_large.pt", "facebook/sam2.1-hiera-large"),
+}
+
+DEFAULT_VARIANT = "large"
+
+# Checkpoints live in python/models/ unless SUPERTRACERY_MODELS_DIR says otherwise
+DEFAULT_MODELS_DIR = os.environ.get("SUPERTRACERY_MODELS_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "models")
+
+_registry = {
+    "variant": DEFAULT_VARIANT,
+    "models_dir": DEFAULT_MODELS_DIR,
+    # Local files only unless downloading is opted into, so air-gapped nodes fail fast
+    "allow_download": os.environ.get("SUPERTRACERY_ALLOW_DOWNLOAD") == "1",
+}
+
+
+def configure_models(options):
+    """Set model, models_dir and allow_download from the run config."""
+    variant = str(options.get("model") or DEFAULT_VARIANT).lower()
+    if variant not in MODEL_VARIANTS:
+        print("INFO:Unknown model '{}', using {}".format(variant, DEFAULT_VARIANT), flush=True)
+        variant = DEFAULT_VARIANT
+    _registry["variant"] = variant
+    if options.get("models_dir"):
+        _registry["models_dir"] = options["models_dir"]
+    if "allow_download" in options:
+        _registry["allow_download"] = bool(options["allow_download"])
+
+
+def model_variant():
+    return _registry["variant"]
+
+
+def checkpoint_path(variant=None):
+    """
+    Local checkpoint for a variant: models_dir first, then the Hugging Face
+    cache. Only with allow_download is it fetched, into models_dir.
+    Raises FileNotFoundError.
+    """
+    variant = variant or _registry["variant"]
+    _, filename, repo = MODEL_VARIANTS[variant]
+    models_dir = _registry["models_dir"]
+    path = os.path.join(models_dir, filename)
+    if os.path.isfile(path):
+        return path
+
+    try:
+        from huggingface_hub import hf_hub_download
+    except ImportError:
+        hf_hub_download = None
+
+    if hf_hub_download is not None:
+        try:
+            return hf_hub_download(repo, filename, local_files_only=True)
+        except Exception:
+            pass
+        if _registry["allow_download"]:
+            print("INFO:Downloading {} to {}".format(filename, models_dir), flush=True)
+            return hf_hub_download(repo, filename, local_dir=models_dir)
+
+    raise FileNotFoundError("SAM2 {} checkpoint not found, expected {} (set allow_download or "
+                            "SUPERTRACERY_ALLOW_DOWNLOAD=1 to fetch it)".format(variant, path))
+
+
+def artifact_dir(name, variant=None):
+    """
+    Directory for build artifacts derived from a variant's checkpoint.
+    Keyed by the checkpoint's size and mtime, so a replaced checkpoint
+    starts from a clean directory.
+    """
+    variant = variant or _registry["variant"]
+    ckpt = checkpoint_path(variant)
+    st = os.stat(ckpt)
+    key = hashlib.sha1("{}|{}|{}".format(
+        os.path.basename(ckpt), st.st_size, st.st_mtime_ns).encode("utf-8")).hexdigest()[:12]
+    path = os.path.join(_registry["models_dir"], "artifacts", "{}-{}".format(variant, key), name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_sam2_model(device):
+    """Build the configured SAM2 variant as a SAM2VideoPredictor and load its local checkpoint."""
+    import torch
+    from sam2.build_sam import build_sam2_video_predictor
+
+    variant = _registry["variant"]
+    config = MODEL_VARIANTS[variant][0]
+    ckpt = checkpoint_path(variant)
+
+    model = build_sam2_video_predictor(config, ckpt_path=None, device=device)
+
+    try:
+        # Memory-mapped: pages in as load_state_dict copies, no second full read
+        checkpoint = torch.load(ckpt, map_location="cpu", weights_only=True, mmap=True)
+    except RuntimeError:
+        checkpoint = torch.load(ckpt, map_location="cpu", weights_only=True)
+    model.load_state_dict(checkpoint["model"])
+    return model
@@ -0,0 +1,298 @@
+"""
+SuperTracery - ONNX Runtime Backend
+SAM2's image encoder and prompt encoder + mask decoder exported to ONNX once
+per checkpoint and run through onnxruntime's CPU execution provider, for
+interactive picking on machines without a GPU. Exports are checked against
+the torch model before they are used.
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+ENCODER_NAME = "image_encoder.onnx"
+DECODER_NAME = "mask_decoder.onnx"
+META_NAME = "export.json"
+OPSET = 17
+
+# Export check: low-res mask IoU against torch on a test image, for every check prompt batch
+MIN_CHECK_IOU = 0.99
+
+
+def _graphs(model):
+    """torch modules wrapping the encoder and decoder halves of SAM2Base for export."""
+    import torch
+
+    class ImageEncoder(torch.nn.Module):
+        """Normalized (1, 3, S, S) image -> image_embed, high_res_0, high_res_1, as set_image() keeps them."""
+
+        def __init__(self, model):
+            super(ImageEncoder, self).__init__()
+            self.model = model
+
+        def forward(self, image):
+            backbone_out = self.model.forward_image(image)
+            _, vision_feats, _, feat_sizes = self.model._prepare_backbone_features(backbone_out)
+            if self.model.directly_add_no_mem_embed:
+                vision_feats[-1] = vision_feats[-1] + self.model.no_mem_embed
+            feats = [feat.permute(1, 2, 0).reshape(1, -1, *size) for feat, size in zip(vision_feats, feat_sizes)]
+            return feats[-1], feats[0], feats[1]
+
+    class MaskDecoder(torch.nn.Module):
+        """Image features + (N, K) point prompts in model input coordinates -> 3 candidates per object."""
+
+        def __init__(self, model):
+            super(MaskDecoder, self).__init__()
+            self.model = model
+
+        def forward(self, image_embed, high_res_0, high_res_1, point_coords, point_labels):
+            prompt_encoder = self.model.sam_prompt_encoder
+            sparse_embeddings, dense_embeddings = prompt_encoder(
+                points=(point_coords, point_labels), boxes=None, masks=None)
+            low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+                image_embeddings=image_embed,
+                image_pe=prompt_encoder.get_dense_pe(),
+                sparse_prompt_embeddings=sparse_embeddings,
+                dense_prompt_embeddings=dense_embeddings,
+                multimask_output=True,
+                repeat_image=True,
+                high_res_features=[high_res_0, high_res_1],
+            )
+            return low_res_masks, iou_predictions
+
+    return ImageEncoder(model).eval(), MaskDecoder(model).eval()
+
+
+def _session(path):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Errors only; shape-merge warnings from the exported encoder are expected
+    options.log_severity_level = 3
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _check_image(image_size):
+    """Deterministic test image: smooth shapes plus noise."""
+    import torch
+    generator = torch.Generator().manual_seed(0)
+    yy, xx = torch.meshgrid(torch.linspace(-1, 1, image_size), torch.linspace(-1, 1, image_size), indexing="ij")
+    blob = (xx * xx + yy * yy < 0.25).float()
+    image = torch.stack([blob, 1.0 - blob, 0.5 * (xx + 1)]) + 0.1 * torch.randn(
+        3, image_size, image_size, generator=generator)
+    return image.unsqueeze(0)
+
+
+def _check_prompts(image_size):
+    """
+    (point_coords, point_labels) batches the decoder is checked on: one
+    click, one click per object for several objects (predict_best), and
+    several clicks with a negative one for a single object (predict).
+    The first is also the export example, so no axis is traced at size 1.
+    """
+    import torch
+    s = float(image_size)
+    return [
+        (torch.tensor([[[0.5 * s, 0.5 * s], [0.3 * s, 0.6 * s]],
+                       [[0.7 * s, 0.3 * s], [0.2 * s, 0.2 * s]]]),
+         torch.tensor([[1, 1], [1, 0]], dtype=torch.int32)),
+        (torch.tensor([[[0.5 * s, 0.5 * s]]]), torch.ones(1, 1, dtype=torch.int32)),
+        (torch.tensor([[[0.5 * s, 0.5 * s]], [[0.2 * s, 0.8 * s]], [[0.8 * s, 0.2 * s]]]),
+         torch.ones(3, 1, dtype=torch.int32)),
+        (torch.tensor([[[0.5 * s, 0.5 * s], [0.55 * s, 0.4 * s], [0.9 * s, 0.9 * s]]]),
+         torch.tensor([[1, 1, 0]], dtype=torch.int32)),
+    ]
+
+
+def _low_res_iou(a, b):
+    a, b = a > 0.0, b > 0.0
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / float(union) if union else 1.0
+
+
+def _plain_encoder(model):
+    """
+    The model's fp32 eager image encoder: the copy kept next to an int8 one,
+    with any torch.compile wrapper set aside. Raises ValueError if there is
+    no such module to export.
+    """
+    import torch
+    encoder = getattr(model, "_st_fp32_encoder", None) or model.image_encoder
+    for module in encoder.modules():
+        if type(module).__module__.startswith("torch.ao.nn.quantized"):
+            raise ValueError("image encoder is quantized, no fp32 copy to export")
+    if any(p.dtype != torch.float32 for p in encoder.parameters()):
+        raise ValueError("image encoder weights are not fp32")
+    return encoder
+
+
+def _record(out_dir, meta):
+    with open(os.path.join(out_dir, META_NAME), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def export_sam2_onnx(model, out_dir):
+    """
+    Export a SAM2Base model's image encoder and mask decoder to out_dir and
+    check them on CPU against the torch model, with one and several objects
+    and clicks. Always exports the plain fp32 encoder, never a compiled or
+    quantized one. Writes export.json with the model's input size and the
+    check results; a failed check is recorded there too, so later runs skip
+    the export (see export_failed).
+    Raises RuntimeError if the ONNX masks do not match within tolerance,
+    ValueError if the model holds no plain fp32 encoder.
+    """
+    import torch
+
+    start = time.time()
+    image_size = model.image_size
+    plain = _plain_encoder(model)
+    encoder, decoder = _graphs(model)
+    image = _check_image(image_size)
+    prompts = _check_prompts(image_size)
+    encoder_path = os.path.join(out_dir, ENCODER_NAME)
+    decoder_path = os.path.join(out_dir, DECODER_NAME)
+
+    # Exported on CPU in fp32 whatever the torch path runs on
+    device = next(model.parameters()).device
+    current = model.image_encoder
+    compiled_forward = plain.__dict__.pop("forward", None)
+    model.image_encoder = plain
+    model.to("cpu")
+    try:
+        with torch.inference_mode():
+            feats = encoder(image)
+            expected = [decoder(*feats, coords, labels) for coords, labels in prompts]
+
+        torch.onnx.export(
+            encoder, (image,), encoder_path + ".tmp", opset_version=OPSET, dynamo=False,
+            input_names=["image"], output_names=["image_embed", "high_res_0", "high_res_1"])
+        torch.onnx.export(
+            decoder, tuple(feats) + prompts[0], decoder_path + ".tmp", opset_version=OPSET, dynamo=False,
+            input_names=["image_embed", "high_res_0", "high_res_1", "point_coords", "point_labels"],
+            output_names=["low_res_masks", "iou_predictions"],
+            dynamic_axes={"point_coords": {0: "objects", 1: "points"}, "point_labels": {0: "objects", 1: "points"},
+                          "low_res_masks": {0: "objects"}, "iou_predictions": {0: "objects"}})
+    finally:
+        model.to(device)
+        model.image_encoder = current
+        if compiled_forward is not None:
+            plain.forward = compiled_forward
+
+    # Check the graphs end to end, encoder output feeding the decoder, on every prompt batch
+    encoded = _session(encoder_path + ".tmp").run(None, {"image": image.numpy()})
+    decoder_session = _session(decoder_path + ".tmp")
+    iou, score_err = 1.0, 0.0
+    try:
+        for (coords, labels), (expected_masks, expected_scores) in zip(prompts, expected):
+            masks, scores = decoder_session.run(None, {
+                "image_embed": encoded[0], "high_res_0": encoded[1], "high_res_1": encoded[2],
+                "point_coords": coords.numpy(), "point_labels": labels.numpy()})
+            if masks.shape != tuple(expected_masks.shape):
+                raise RuntimeError("decoder output {} for {} prompts, expected {}".format(
+                    masks.shape, tuple(coords.shape[:2]), tuple(expected_masks.shape)))
+            iou = min([iou] + [_low_res_iou(masks[n, i], expected_masks[n, i].numpy())
+                               for n in range(masks.shape[0]) for i in range(masks.shape[1])])
+            score_err = max(score_err, float(np.abs(scores - expected_scores.numpy()).max()))
+        if iou < MIN_CHECK_IOU:
+            raise RuntimeError("ONNX export does not match torch (mask IoU {:.4f})".format(iou))
+    except Exception as e:
+        for path in (encoder_path, decoder_path):
+            os.remove(path + ".tmp")
+        _record(out_dir, {"ok": False, "error": str(e)[:300], "opset": OPSET})
+        raise RuntimeError(str(e))
+
+    os.replace(encoder_path + ".tmp", encoder_path)
+    os.replace(decoder_path + ".tmp", decoder_path)
+    meta = {"ok": True, "image_size": image_size, "opset": OPSET, "check_iou": round(iou, 6),
+            "check_score_err": score_err}
+    _record(out_dir, meta)
+    print("INFO:Exported SAM2 to ONNX in {:.1f}s (check IoU {:.4f})".format(time.time() - start, iou), flush=True)
+    return meta
+
+
+def _meta(out_dir):
+    try:
+        with open(os.path.join(out_dir, META_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def has_export(out_dir):
+    """True if out_dir holds an export that passed its check."""
+    return (_meta(out_dir).get("ok") is True and
+            all(os.path.isfile(os.path.join(out_dir, name)) for name in (ENCODER_NAME, DECODER_NAME)))
+
+
+def export_failed(out_dir):
+    """The recorded reason an earlier export failed its check, else None."""
+    meta = _meta(out_dir)
+    return meta.get("error", "check failed") if meta.get("ok") is False else None
+
+
+class OnnxImagePredictor(object):
+    """
+    SAM2ImagePredictor look-alike on ONNX Runtime sessions: set_image(),
+    predict() for one object's clicks and predict_best() for one click per
+    object. Pre- and post-processing are SAM2's own transforms.
+    """
+
+    mask_threshold = 0.0
+
+    def __init__(self, out_dir):
+        from sam2.utils.transforms import SAM2Transforms
+
+        with open(os.path.join(out_dir, META_NAME), "r") as f:
+            self.meta = json.load(f)
+        self.image_size = int(self.meta["image_size"])
+        self._encoder = _session(os.path.join(out_dir, ENCODER_NAME))
+        self._decoder = _session(os.path.join(out_dir, DECODER_NAME))
+        self._transforms = SAM2Transforms(resolution=self.image_size, mask_threshold=self.mask_threshold)
+        self._features = None
+        self._orig_hw = None
+
+    def set_image(self, image):
+        """image: RGB uint8 (H, W, 3)."""
+        tensor = self._transforms(image).unsqueeze(0)
+        embed, high_res_0, high_res_1 = self._encoder.run(None, {"image": tensor.numpy()})
+        self._features = {"image_embed": embed, "high_res_0": high_res_0, "high_res_1": high_res_1}
+        self._orig_hw = image.shape[:2]
+
+    def _decode(self, point_coords, point_labels):
+        """(N, K, 2) frame coordinates and (N, K) labels -> (N, 3, h, w) low-res logits, (N, 3) scores."""
+        import torch
+        coords = self._transforms.transform_coords(
+            torch.as_tensor(point_coords, dtype=torch.float), normalize=True, orig_hw=self._orig_hw)
+        feeds = dict(self._features)
+        feeds["point_coords"] = coords.numpy()
+        feeds["point_labels"] = np.asarray(point_labels, dtype=np.int32)
+        return self._decoder.run(None, feeds)
+
+    def _upsample(self, low_res):
+        import torch
+        return self._transforms.postprocess_masks(torch.from_numpy(low_res), self._orig_hw).numpy()
+
+    def predict(self, point_coords, point_labels, multimask_output=True):
+        """
+        Clicks for one object, like SAM2ImagePredictor.predict().
+        Returns (masks (C, H, W) float 0/1, scores (C,), low-res logits (C, h, w));
+        C is 3, or 1 without multimask_output.
+        """
+        low_res, scores = self._decode(point_coords[None], point_labels[None])
+        if not multimask_output:
+            best = int(np.argmax(scores[0]))
+            low_res, scores = low_res[:, best:best + 1], scores[:, best:best + 1]
+        masks = (self._upsample(low_res)[0] > self.mask_threshold).astype(np.float32)
+        return masks, scores[0], low_res[0]
+
+    def predict_best(self, points, low_res=False):
+        """One click per object, (N, 2) frame coordinates; same return as tracker._predict_best()."""
+        logits, scores = self._decode(points[:, None, :], np.ones((len(points), 1), dtype=np.int32))
+        rows = np.arange(len(points))
+        best = scores.argmax(axis=1)
+        logits = logits[rows, best][:, None]
+        if not low_res:
+            logits = self._upsample(logits)
+        return (logits[:, 0] > self.mask_threshold).astype(np.uint8), scores[rows, best]
@@ -5,8 +5,12 @@ Persistent stdin/stdout process for interactive segmentation preview.
 
 Usage:
     python3 preview_server.py <frame_path>
+    python3 preview_server.py <frames_dir>/st_frames.store <frame_index>
 
 Startup: loads image, calls SAM2ImagePredictor.set_image(), prints READY
+(SUPERTRACERY_BACKEND=onnx runs the image predictor on ONNX Runtime, CPU;
+SUPERTRACERY_LOWRES_POLYGONS=1 contours the low-res logits, like the
+tracker's lowres_polygons option)
 Query protocol (JSON lines on stdin/stdout):
     Input:  {"x": 320, "y": 240}
     Output: {"bbox": [x1,y1,x2,y2], "polygon": [[x,y],...], "score": 0.92, "centroid": [cx,cy]}
@@ -19,7 +23,8 @@ import json
 import numpy as np
 import cv2
 
-from tracker import get_sam2_image_predictor, _mask_to_polygon
+from frames import STORE_NAME, FrameStore
+from tracker import get_picking_predictor, _mask_to_polygon, _logits_to_polygon
 
 
 def main():
@@ -32,14 +37,21 @@ def main():
         print("ERROR:Frame not found: " + frame_path, flush=True)
         sys.exit(1)
 
-    # Load SAM2 image predictor
-    predictor = get_sam2_image_predictor()
+    # Load SAM2 image predictor (ONNX Runtime with SUPERTRACERY_BACKEND=onnx)
+    predictor = get_picking_predictor()
     if predictor is None:
         print("ERROR:SAM2 not available", flush=True)
         sys.exit(1)
 
-    # Load and set image
-    image = cv2.imread(frame_path)
+    # Load and set image (zero-copy view when reading from a frame store)
+    if os.path.basename(frame_path) == STORE_NAME:
+        frame_index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        try:
+            image = FrameStore(frame_path).bgr(frame_index)
+        except (ValueError, IndexError):
+            image = None
+    else:
+        image = cv2.imread(frame_path)
     if image is None:
         print("ERROR:Could not read image: " + frame_path, flush=True)
         sys.exit(1)
@@ -47,6 +59,9 @@ def main():
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     predictor.set_image(image_rgb)
 
+    # Opt-in like lowres_polygons in the run config, so picked and tracked outlines match
+    lowres_polygons = os.environ.get("SUPERTRACERY_LOWRES_POLYGONS") == "1"
+
     print("READY", flush=True)
 
     # Query loop — read JSON lines from stdin
@@ -65,7 +80,7 @@ def main():
             point_coords = np.array([[x, y]], dtype=np.float32)
             point_labels = np.array([1], dtype=np.int32)
 
-            pred_masks, scores, _ = predictor.predict(
+            pred_masks, scores, low_res_logits = predictor.predict(
                 point_coords=point_coords,
                 point_labels=point_labels,
                 multimask_output=True
@@ -93,8 +108,15 @@ def main():
                 cx, cy = x, y
             centroid = [round(cx, 2), round(cy, 2)]
 
-            # Polygon (simplified for fast transfer)
-            polygon = _mask_to_polygon(mask, max_points=32)
+            # Polygon (simplified for fast transfer), traced the same way tracked outlines are
+            polygon = None
+            if lowres_polygons:
+                try:
+                    polygon = _logits_to_polygon(low_res_logits[best_idx], mask.shape, max_points=32)
+                except ImportError:
+                    pass
+            if polygon is None:
+                polygon = _mask_to_polygon(mask, max_points=32)
 
             result = {
                 "bbox": bbox,
@@ -9,13 +9,98 @@ Usage:
 Input JSON:
     {
         "mode": "segment_and_track",
-        "frames_dir": "/path/to/frames",
-        "click_points": [{"x": 320, "y": 240, "object_id": 0}],
+        "frames_dir": "/path/to/frames",       (or "video_path": "/path/to/plate.mov")
+        "click_points": [{"x": 320, "y": 240, "object_id": 0, "frame_index": 0}],
         "output_dir": "/path/to/output",
         "comp_width": 1920,
         "comp_height": 1080
     }
 
+click_points[].frame_index is the comp frame the point was picked on (default:
+first tracked frame). Each object is tracked backward and forward from there.
+
+Optional keys:
+    frame_cache_mb    budget for decoded frames shared across stages (default 1024)
+    frame_store       pack the PNG sequence into a memory-mapped raw frame store,
+                      reused by later runs on the same frames (default false)
+    prefetch_depth    frames decoded ahead on a thread pool, 0 to disable (default 4)
+    video_path        decode an mp4/mov/mkv directly instead of a PNG sequence
+    start_frame       first comp frame to track (default 0)
+    end_frame         last comp frame to track, inclusive (default: last frame)
+    stride            track every Nth frame and interpolate the rest (default 1)
+    proxy_scale       track on frames downsampled by this factor (e.g. 0.5, 0.25);
+                      results are mapped back to comp pixels (default 1)
+    dedupe_frames     detect held/repeated frames, track each unique frame once and
+                      copy its results to the repeats (default false)
+    stage_frames      pre-resize frames to SAM2 input resolution on a process pool
+                      before propagation (default false)
+    stage_workers     staging processes (default: CPU count)
+    model             SAM2 variant: tiny, small, base_plus or large (default large)
+    models_dir        folder holding SAM2 checkpoints (default python/models/, or
+                      $SUPERTRACERY_MODELS_DIR)
+    allow_download    fetch a missing checkpoint from Hugging Face into models_dir
+                      (default false: local files only, true when
+                      $SUPERTRACERY_ALLOW_DOWNLOAD=1)
+    track_backward    also track objects backward from their prompt frame (default true)
+    precision         SAM2 inference precision: fp32, bf16 or fp16 autocast, or int8
+                      (CPU only): Linear layers of the image encoder quantized
+                      dynamically, convs kept fp32, so only part of the encoder
+                      gets faster; its masks are compared with fp32 on the shot's
+                      frames before first use (default fp32)
+    int8_frames       evenly spaced frames the int8 comparison uses besides the prompt
+                      frames; shots with no more frames than that run fp32 (default 4)
+    int8_min_iou      mean mask IoU against fp32 below which int8 falls back to
+                      fp32 (default 0.9)
+    compile           torch.compile the image encoder: true or a torch.compile mode
+                      such as "max-autotune" (default false); warmed up at load
+    backend           click picking backend: "torch", or "onnx" to run the image
+                      encoder and mask decoder on ONNX Runtime's CPU provider,
+                      exported and checked against torch on first use (default
+                      $SUPERTRACERY_BACKEND, else torch)
+    exit_frames       stop tracking an object once its mask has been empty this many
+                      frames in a row; later frames are marked "absent" (default 0: off)
+    redetect_every    look for exited objects again every this many frames and
+                      resume tracking them when found (default 0: off)
+    redetect_score    appearance match score needed to re-detect (default 0.8)
+    polygons          trace a mask outline polygon per frame; false leaves them empty
+                      for runs that only need centroid, bbox, area and luma (default true)
+    lowres_polygons   contour SAM2's low-resolution mask logits for the polygons
+                      instead of tracing full-resolution masks; smoother and cheaper
+                      on large plates, not used with roi (default false); the
+                      preview server follows $SUPERTRACERY_LOWRES_POLYGONS=1
+    roi               track each object on a crop around its predicted position
+                      with the image predictor instead of on whole frames; for small
+                      subjects in large plates (default false)
+    roi_margin        crop padding around the predicted box, as a fraction of its
+                      size on each side (default 0.5)
+    roi_min_score     below this predicted IoU an object is re-segmented on the
+                      full frame (default 0.5)
+    window_frames     propagate in windows of this many frames, resetting SAM2's
+                      tracking state between them (default 0: whole clip at once)
+    window_mb         derive window_frames from a budget for SAM2's tracking state
+    window_overlap    frames each window re-tracks from the previous one (default 8)
+    stitch_iou        overlap IoU a window needs to take over; below it the next
+                      window is reseeded at the previous window's end (default 0.8)
+
+Correct mode ("mode": "correct") takes the same keys as segment_and_track, with
+click_points holding one correction click per drifted object at the frame it
+drifted on. The objects are re-tracked forward from there until they agree with
+the previous results.json again and the re-tracked span is spliced in:
+    converge_iou      IoU with the previous mask that counts as agreeing (default 0.9)
+    converge_frames   consecutive agreeing frames before stopping (default 3)
+
+Cache mode ("mode": "cache") manages exported frame sets for the panel:
+    {
+        "mode": "cache",
+        "action": "validate",                  (validate | commit | evict | clear)
+        "cache_dir": "/path/to/frames",
+        "cache_params": {"comp": "Shot 010", "width": 1920, ...},
+        "expected_frames": 120,
+        "cache_budget_mb": 20480
+    }
+    Prints CACHE:VALID:<dir> or CACHE:STALE:<dir> (validate), CACHE:SAVED:<dir>
+    (commit) or CACHE:CLEARED:<cache_dir> (evict, clear).
+
 Output: writes results.json to output_dir
 Progress: prints PROGRESS:N/TOTAL to stdout
 Completion: prints DONE to stdout
@@ -26,20 +111,188 @@ import os
 import sys
 import json
 import traceback
-
+import numpy as np
+import cv2
+
+from frames import (
+    ImageSequence,
+    VideoFrames,
+    FrameSubset,
+    ScaledFrames,
+    open_frame_store,
+    configure_frame_cache,
+    get_frame_cache,
+    find_held_frames
+)
+from masks import PackedMask
+from cache_index import FrameCacheIndex, cache_key, DEFAULT_BUDGET_MB, MANIFEST_NAME
+from model_registry import configure_models
 from tracker import (
+    configure_inference,
+    check_quantization,
     load_frames,
     segment_single_frame,
-    propagate_masks,
+    iter_propagated_masks,
     analyze_frame,
-    smooth_motion_vectors
+    smooth_motion_vectors,
+    interpolate_skipped_frames,
+    copy_held_frames
 )
 
 
+def _record_frame_store(frames_dir, store_path):
+    """Count a frame store toward the disk budget of the cached frame set it was built in, if any."""
+    cache_root, key = os.path.split(os.path.normpath(frames_dir))
+    if not os.path.isfile(os.path.join(cache_root, MANIFEST_NAME)):
+        return
+    index = FrameCacheIndex(cache_root)
+    if index.record_store(key, store_path):
+        index.save()
+
+
+def load_frame_source(config):
+    """
+    Open the configured frame source: a video container, or the exported
+    PNG sequence (packed into a frame store if requested).
+    Returns None if there are no frames.
+    """
+    video_path = config.get("video_path")
+    if video_path:
+        print("INFO:Streaming frames from {}".format(video_path), flush=True)
+        return VideoFrames(video_path)
+
+    frames_dir = config["frames_dir"]
+    frame_paths = load_frames(frames_dir)
+    if not frame_paths:
+        return None
+
+    if config.get("frame_store", False):
+        try:
+            store = open_frame_store(frames_dir, frame_paths)
+            _record_frame_store(frames_dir, store.store_path)
+            return store
+        except (OSError, ValueError) as e:
+            print("INFO:Frame store unavailable ({}), decoding PNGs".format(str(e)[:80]), flush=True)
+    return ImageSequence(frame_paths)
+
+
+def select_frames(frames, config):
+    """
+    Restrict a frame source to the [start_frame, end_frame] work area,
+    sampled every stride frames. The last frame of the range is always
+    included so skipped frames are interpolated, never extrapolated.
+    """
+    last = len(frames) - 1
+    start = min(max(0, int(config.get("start_frame") or 0)), last)
+    end = config.get("end_frame")
+    end = last if end is None else min(max(start, int(end)), last)
+    stride = max(1, int(config.get("stride") or 1))
+
+    indices = list(range(start, end + 1, stride))
+    if indices[-1] != end:
+        indices.append(end)
+    return FrameSubset(frames, indices)
+
+
+def prepare_frames(config):
+    """
+    Open the frame source and apply the run's proxy scale, work area, stride
+    and held-frame dedupe.
+    Returns (frames, proxy_scale, held); frames is None if there are no frames.
+    held: dict of comp frame -> comp frame whose image it repeats.
+    """
+    frames = load_frame_source(config)
+    if frames is None:
+        return None, 1.0, {}
+
+    print("INFO:Found {} frames".format(len(frames)), flush=True)
+
+    # Proxy resolution: click points go to proxy pixels, analysis maps back
+    proxy_scale = float(config.get("proxy_scale") or 1.0)
+    if 0.0 < proxy_scale < 1.0:
+        frames = ScaledFrames(frames, proxy_scale)
+        print("INFO:Tracking at proxy scale {} ({}x{})".format(
+            proxy_scale, frames.shape[1], frames.shape[0]), flush=True)
+    else:
+        proxy_scale = 1.0
+
+    # Work area and stride; results stay indexed by comp frame
+    frames = select_frames(frames, config)
+    total_frames = len(frames)
+    if total_frames < len(frames.frames):
+        print("INFO:Tracking {} of {} frames ({}-{})".format(
+            total_frames, len(frames.frames), frames.indices[0], frames.indices[-1]), flush=True)
+
+    # Held frames: track each unique frame once, copy results to the repeats
+    held = {}
+    if config.get("dedupe_frames", False):
+        first_of_run = find_held_frames(frames)
+        held = {frames.indices[i]: frames.indices[first] for i, first in enumerate(first_of_run) if first != i}
+        if held:
+            unique = [frames.indices[i] for i, first in enumerate(first_of_run) if first == i]
+            frames = FrameSubset(frames.frames, unique)
+            print("INFO:Skipping {} held frames, {} unique".format(len(held), len(frames)), flush=True)
+
+    return frames, proxy_scale, held
+
+
+def prompt_points(frames, click_points, proxy_scale):
+    """
+    Map click points to tracking space: proxy pixels, and frame_index from
+    the comp frame the point was picked on to the nearest tracked frame.
+    """
+    return [dict(pt,
+                 x=pt["x"] * proxy_scale,
+                 y=pt["y"] * proxy_scale,
+                 frame_index=frames.local_index(pt.get("frame_index", frames.indices[0])))
+            for pt in click_points]
+
+
+def segment_prompts(frames, click_points):
+    """Segment each object on its prompt frame. Returns dict of object_id -> mask."""
+    # int8 is checked against fp32 on this shot before anything is tracked with it
+    check_quantization(frames, click_points)
+    prompt_frames = sorted(set(pt["frame_index"] for pt in click_points))
+    print("INFO:Segmenting {} prompt frame(s)...".format(len(prompt_frames)), flush=True)
+    initial_masks = {}
+    for prompt_idx in prompt_frames:
+        points = [pt for pt in click_points if pt["frame_index"] == prompt_idx]
+        initial_masks.update(segment_single_frame(frames.bgr(prompt_idx), points, keep_features=True))
+    return initial_masks
+
+
+def frame_result(gray, mask, prev_centroid, comp_frame, comp_width, comp_height, proxy_scale,
+                 trace_polygon=True):
+    """Per-frame result dict for one object, or an empty placeholder without a mask."""
+    if mask is None or gray is None:
+        # No mask for this frame, skip or use empty
+        frame_data = {
+            "frame_index": comp_frame,
+            "time": round(comp_frame / 30.0, 6),  # approximate
+            "centroid": [comp_width / 2.0, comp_height / 2.0],
+            "bbox": [0, 0, comp_width, comp_height],
+            "polygon": [],
+            "area": 0,
+            "avg_luma": 0.0,
+            "motion_vector": [0.0, 0.0],
+            "confidence": 0.0
+        }
+        if mask is None:
+            # Not tracked here: before the object appeared or after it left the shot
+            frame_data["absent"] = True
+        return frame_data
+
+    frame_data = analyze_frame(gray, mask, prev_centroid, proxy_scale, trace_polygon)
+    frame_data["frame_index"] = comp_frame
+    frame_data["time"] = round(comp_frame / 30.0, 6)  # will be recalculated by JSX using fps
+    frame_data["confidence"] = float(
+        min(1.0, frame_data["area"] / max(1, comp_width * comp_height * 0.001))
+    )
+    return frame_data
+
+
 def run_segment_and_track(config):
     """Main pipeline: segment on first frame, propagate, analyze all frames."""
-    frames_dir = config["frames_dir"]
-    click_points = config["click_points"]
     output_dir = config["output_dir"]
     comp_width = config.get("comp_width", 1920)
     comp_height = config.get("comp_height", 1080)
@@ -47,18 +300,21 @@ def run_segment_and_track(config):
     # Ensure output dir exists
     os.makedirs(output_dir, exist_ok=True)
 
-    # Load frame paths
-    frame_paths = load_frames(frames_dir)
-    if not frame_paths:
-        print("ERROR:No frames found in {}".format(frames_dir), flush=True)
-        return
+    if "frame_cache_mb" in config:
+        configure_frame_cache(config["frame_cache_mb"])
+    configure_models(config)
+    configure_inference(config)
 
-    total_frames = len(frame_paths)
-    print("INFO:Found {} frames".format(total_frames), flush=True)
+    # Load frame source
+    frames, proxy_scale, held = prepare_frames(config)
+    if frames is None:
+        print("ERROR:No frames found in {}".format(config.get("frames_dir")), flush=True)
+        return
+    total_frames = len(frames)
 
-    # Step 1: Segment first frame
-    print("INFO:Segmenting first frame...", flush=True)
-    initial_masks = segment_single_frame(frame_paths[0], click_points)
+    # Step 1: Segment each object on its prompt frame
+    click_points = prompt_points(frames, config["click_points"], proxy_scale)
+    initial_masks = segment_prompts(frames, click_points)
 
     if not initial_masks:
         print("ERROR:Segmentation produced no masks", flush=True)
@@ -66,58 +322,37 @@ def run_segment_and_track(config):
 
     print("INFO:Segmented {} objects".format(len(initial_masks)), flush=True)
 
-    # Step 2: Propagate masks across all frames
-    print("INFO:Propagating masks across {} frames...".format(total_frames), flush=True)
-    all_masks = propagate_masks(frames_dir, frame_paths, initial_masks, click_points)
+    # Step 2+3: Propagate masks and analyze each frame as it arrives.
+    # Masks are dropped once analyzed; only the last centroid per object is kept.
+    print("INFO:Propagating and analyzing {} frames...".format(total_frames), flush=True)
+    obj_ids = sorted(initial_masks.keys())
+    objects = {obj_id: {"object_id": obj_id, "frames": []} for obj_id in obj_ids}
+    prev_centroids = {obj_id: None for obj_id in obj_ids}
+    trace_polygon = config.get("polygons", True)
+
+    for frame_idx, masks in iter_propagated_masks(frames, initial_masks, click_points, config):
+        gray = frames.luma(frame_idx)
+        comp_frame = frames.source_index(frame_idx)
+        for obj_id in obj_ids:
+            mask = masks.get(obj_id)
+            frame_data = frame_result(gray, mask, prev_centroids[obj_id], comp_frame,
+                                      comp_width, comp_height, proxy_scale, trace_polygon)
+            if mask is not None and gray is not None:
+                prev_centroids[obj_id] = frame_data["centroid"]
+            objects[obj_id]["frames"].append(frame_data)
 
-    # Step 3: Analyze each frame for each object
-    print("INFO:Analyzing frames...", flush=True)
     results = {"objects": []}
-
-    for obj_id in sorted(all_masks.keys()):
-        obj_data = {
-            "object_id": obj_id,
-            "frames": []
-        }
-
-        prev_centroid = None
-        masks_list = all_masks[obj_id]
-
-        for frame_idx in range(total_frames):
-            mask = masks_list[frame_idx]
-            if mask is None:
-                # No mask for this frame, skip or use empty
-                obj_data["frames"].append({
-                    "frame_index": frame_idx,
-                    "time": round(frame_idx / 30.0, 6),  # approximate
-                    "centroid": [comp_width / 2.0, comp_height / 2.0],
-                    "bbox": [0, 0, comp_width, comp_height],
-                    "polygon": [],
-                    "area": 0,
-                    "avg_luma": 0.0,
-                    "motion_vector": [0.0, 0.0],
-                    "confidence": 0.0
-                })
-                continue
-
-            frame_data = analyze_frame(frame_paths[frame_idx], mask, prev_centroid)
-            frame_data["frame_index"] = frame_idx
-            frame_data["time"] = round(frame_idx / 30.0, 6)  # will be recalculated by JSX using fps
-            frame_data["confidence"] = float(
-                min(1.0, frame_data["area"] / max(1, comp_width * comp_height * 0.001))
-            )
-
-            prev_centroid = frame_data["centroid"]
-            obj_data["frames"].append(frame_data)
-
-            if frame_idx % 10 == 0:
-                print("PROGRESS:{}/{}".format(frame_idx + 1, total_frames), flush=True)
-
-        # Smooth motion vectors
+    for obj_id in obj_ids:
+        obj_data = objects[obj_id]
+        # Restore held frames, fill frames skipped by the stride, then smooth motion vectors
+        obj_data["frames"] = copy_held_frames(obj_data["frames"], held)
+        obj_data["frames"] = interpolate_skipped_frames(obj_data["frames"])
         obj_data["frames"] = smooth_motion_vectors(obj_data["frames"], window=3)
-
         results["objects"].append(obj_data)
 
+    stats = get_frame_cache().stats()
+    print("INFO:Frame cache: {} hits, {} misses".format(stats["hits"], stats["misses"]), flush=True)
+
     # Write results
     output_path = os.path.join(output_dir, "results.json")
     with open(output_path, "w") as f:
@@ -127,31 +362,240 @@ def run_segment_and_track(config):
     print("DONE", flush=True)
 
 
+def _polygon_mask(polygon, shape, scale):
+    """Rasterize a comp-space result polygon into a PackedMask at tracking scale."""
+    mask = np.zeros(shape, dtype=np.uint8)
+    if len(polygon) >= 3:
+        pts = np.round(np.array(polygon, dtype=np.float64) * scale).astype(np.int32)
+        cv2.fillPoly(mask, [pts], 1)
+    return PackedMask.from_dense(mask)
+
+
+def _bbox_mask(bbox, shape, scale):
+    """Rasterize a comp-space result bbox into a PackedMask at tracking scale."""
+    mask = np.zeros(shape, dtype=np.uint8)
+    x0, y0, x1, y1 = [int(round(v * scale)) for v in bbox]
+    mask[max(0, y0):max(0, y1), max(0, x0):max(0, x1)] = 1
+    return PackedMask.from_dense(mask)
+
+
+def _result_iou(new, old, shape, scale):
+    """
+    IoU of two per-frame results of one object: their simplified polygons,
+    or their bboxes when either side has none (e.g. traced with polygons
+    false), always like with like.
+    """
+    if not (new["area"] and old["area"]):
+        # Both empty agree, one empty does not
+        return 0.0 if new["area"] or old["area"] else 1.0
+    if len(new["polygon"]) >= 3 and len(old["polygon"]) >= 3:
+        return _polygon_mask(new["polygon"], shape, scale).iou(_polygon_mask(old["polygon"], shape, scale))
+    return _bbox_mask(new["bbox"], shape, scale).iou(_bbox_mask(old["bbox"], shape, scale))
+
+
+def _splice_frames(old_frames, segment):
+    """Replace old_frames over the comp frames segment spans with segment."""
+    first, last = segment[0]["frame_index"], segment[-1]["frame_index"]
+    before = [f for f in old_frames if f["frame_index"] < first]
+    after = [f for f in old_frames if f["frame_index"] > last]
+
+    # The first old frame after the splice now moves on from the re-tracked centroid
+    if after and segment[-1]["area"] > 0 and after[0]["area"] > 0:
+        gap = after[0]["frame_index"] - last
+        after[0]["motion_vector"] = [
+            round((after[0]["centroid"][k] - segment[-1]["centroid"][k]) / gap, 2) for k in (0, 1)
+        ]
+    return before + segment + after
+
+
+def run_correct(config):
+    """
+    Corrective re-track: re-prompt drifted objects on the frame of the
+    correction click, propagate forward only until the new masks agree with
+    the previous results again, and splice that span into results.json.
+    """
+    output_dir = config["output_dir"]
+    comp_width = config.get("comp_width", 1920)
+    comp_height = config.get("comp_height", 1080)
+    converge_iou = float(config.get("converge_iou", 0.9))
+    converge_frames = max(1, int(config.get("converge_frames", 3)))
+    # Trace like the original run did; convergence falls back to bboxes without polygons
+    trace_polygon = config.get("polygons", True)
+
+    output_path = os.path.join(output_dir, "results.json")
+    if not os.path.exists(output_path):
+        print("ERROR:No previous results in {}".format(output_dir), flush=True)
+        return
+    with open(output_path, "r") as f:
+        results = json.load(f)
+    objects = {obj["object_id"]: obj for obj in results["objects"]}
+
+    unknown = [pt["object_id"] for pt in config["click_points"] if pt["object_id"] not in objects]
+    if unknown:
+        print("ERROR:No previous track for object(s) {}".format(unknown), flush=True)
+        return
+
+    if "frame_cache_mb" in config:
+        configure_frame_cache(config["frame_cache_mb"])
+    configure_models(config)
+    configure_inference(config)
+
+    frames, proxy_scale, held = prepare_frames(config)
+    if frames is None:
+        print("ERROR:No frames found in {}".format(config.get("frames_dir")), flush=True)
+        return
+
+    # Only the frames from the earliest correction onward are re-tracked
+    click_points = prompt_points(frames, config["click_points"], proxy_scale)
+    start = min(pt["frame_index"] for pt in click_points)
+    tail = FrameSubset(frames.frames, frames.indices[start:])
+    click_points = [dict(pt, frame_index=pt["frame_index"] - start) for pt in click_points]
+
+    initial_masks = segment_prompts(tail, click_points)
+    if not initial_masks:
+        print("ERROR:Segmentation produced no masks", flush=True)
+        return
+
+    obj_ids = sorted(initial_masks.keys())
+    prompt_frames = {pt["object_id"]: pt["frame_index"] for pt in click_points}
+    previous = {obj_id: {f["frame_index"]: f for f in objects[obj_id]["frames"]} for obj_id in obj_ids}
+    segments = {obj_id: [] for obj_id in obj_ids}
+    prev_centroids = {}
+    for obj_id in obj_ids:
+        comp_prompt = tail.source_index(prompt_frames[obj_id])
+        earlier = [f for i, f in previous[obj_id].items() if i < comp_prompt and f["area"] > 0]
+        prev_centroids[obj_id] = max(earlier, key=lambda f: f["frame_index"])["centroid"] if earlier else None
+    agree = {obj_id: 0 for obj_id in obj_ids}
+    converged = set()
+
+    print("INFO:Re-tracking {} object(s) from frame {}...".format(len(obj_ids), tail.indices[0]), flush=True)
+    propagation = iter_propagated_masks(tail, initial_masks, click_points, dict(config, track_backward=False))
+    try:
+        for frame_idx, masks in propagation:
+            gray = tail.luma(frame_idx)
+            comp_frame = tail.source_index(frame_idx)
+            for obj_id in obj_ids:
+                if obj_id in converged or frame_idx < prompt_frames[obj_id]:
+                    continue
+                mask = masks.get(obj_id)
+                frame_data = frame_result(gray, mask, prev_centroids[obj_id], comp_frame,
+                                          comp_width, comp_height, proxy_scale, trace_polygon)
+                if mask is not None and gray is not None:
+                    prev_centroids[obj_id] = frame_data["centroid"]
+                segments[obj_id].append(frame_data)
+
+                # Converged once the new track agrees with the old one for a few frames
+                old = previous[obj_id].get(comp_frame)
+                if mask is None or old is None or frame_idx == prompt_frames[obj_id]:
+                    continue
+                iou = _result_iou(frame_data, old, tail.shape, proxy_scale)
+                agree[obj_id] = agree[obj_id] + 1 if iou >= converge_iou else 0
+                if agree[obj_id] >= converge_frames:
+                    converged.add(obj_id)
+                    print("INFO:Object {} rejoined its previous track at frame {}".format(
+                        obj_id, comp_frame), flush=True)
+
+            if len(converged) == len(obj_ids):
+                break
+    finally:
+        propagation.close()
+
+    for obj_id in obj_ids:
+        segment = segments[obj_id]
+        if not segment:
+            continue
+        span = set(f["frame_index"] for f in segment)
+        segment = copy_held_frames(segment, {k: v for k, v in held.items() if v in span})
+        segment = interpolate_skipped_frames(segment)
+        segment = smooth_motion_vectors(segment, window=3)
+        objects[obj_id]["frames"] = _splice_frames(objects[obj_id]["frames"], segment)
+        print("INFO:Object {}: replaced frames {}-{}".format(
+            obj_id, segment[0]["frame_index"], segment[-1]["frame_index"]), flush=True)
+
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("INFO:Results written to {}".format(output_path), flush=True)
+    print("DONE", flush=True)
+
+
 def run_segment_only(config):
     """Segment a single frame without propagation (for preview)."""
-    frames_dir = config["frames_dir"]
     click_points = config["click_points"]
     output_dir = config["output_dir"]
 
     os.makedirs(output_dir, exist_ok=True)
+    configure_models(config)
+    configure_inference(config)
 
-    frame_paths = load_frames(frames_dir)
-    if not frame_paths:
+    frames = load_frame_source(config)
+    if frames is None:
         print("ERROR:No frames found", flush=True)
         return
 
-    masks = segment_single_frame(frame_paths[0], click_points)
+    # Same int8 check as before tracking, on the frames the clicks land on
+    check_quantization(frames, [dict(pt, frame_index=min(pt.get("frame_index", 0), len(frames) - 1))
+                                for pt in click_points])
+
+    masks = {}
+    for frame_index in sorted(set(pt.get("frame_index", 0) for pt in click_points)):
+        points = [pt for pt in click_points if pt.get("frame_index", 0) == frame_index]
+        masks.update(segment_single_frame(frames.bgr(min(frame_index, len(frames) - 1)), points))
 
     # Save mask previews as PNGs
     for obj_id, mask in masks.items():
         mask_path = os.path.join(output_dir, "mask_{}.png".format(obj_id))
-        import cv2
         cv2.imwrite(mask_path, mask * 255)
 
     print("INFO:Segmentation complete, {} masks saved".format(len(masks)), flush=True)
     print("DONE", flush=True)
 
 
+def run_cache(config):
+    """Validate, record or evict exported frame sets in the frame cache index."""
+    index = FrameCacheIndex(config["cache_dir"])
+    action = config.get("action", "validate")
+    budget_bytes = int(config.get("cache_budget_mb", DEFAULT_BUDGET_MB)) * 1024 * 1024
+
+    params = config.get("cache_params")
+    key = cache_key(params) if params is not None else None
+    if key is None and action in ("validate", "commit"):
+        print("ERROR:cache_params required for '{}'".format(action), flush=True)
+        return
+
+    if action == "validate":
+        frames_dir = index.frames_dir(key)
+        ok, reason = index.validate(key, config.get("expected_frames"))
+        if ok:
+            index.touch(key)
+            print("INFO:Frame cache hit ({} frames)".format(len(index.sets[key]["frames"])), flush=True)
+            print("CACHE:VALID:{}".format(frames_dir), flush=True)
+        else:
+            # Drop the stale record; the panel re-exports into the same folder
+            index.sets.pop(key, None)
+            print("INFO:Frame cache miss ({})".format(reason), flush=True)
+            print("CACHE:STALE:{}".format(frames_dir), flush=True)
+    elif action == "commit":
+        entry = index.commit(key, params)
+        removed = index.evict(budget_bytes, keep=(key,))
+        print("INFO:Cached {} frames ({:.1f} MB), evicted {} old frame sets".format(
+            len(entry["frames"]), entry["bytes"] / (1024.0 * 1024.0), len(removed)), flush=True)
+        print("CACHE:SAVED:{}".format(index.frames_dir(key)), flush=True)
+    elif action == "evict":
+        removed = index.evict(budget_bytes)
+        print("INFO:Evicted {} frame sets".format(len(removed)), flush=True)
+        print("CACHE:CLEARED:{}".format(index.cache_root), flush=True)
+    elif action == "clear":
+        index.clear()
+        print("CACHE:CLEARED:{}".format(index.cache_root), flush=True)
+    else:
+        print("ERROR:Unknown cache action '{}'".format(action), flush=True)
+        return
+
+    index.save()
+    print("DONE", flush=True)
+
+
 def main():
     try:
         if len(sys.argv) < 2:
@@ -167,6 +611,10 @@ def main():
             run_segment_and_track(config)
         elif mode == "segment_only":
             run_segment_only(config)
+        elif mode == "correct":
+            run_correct(config)
+        elif mode == "cache":
+            run_cache(config)
         else:
             print("ERROR:Unknown mode '{}'".format(mode), flush=True)
             sys.exit(1)
@@ -0,0 +1,102 @@
+"""
+Image encoder calls of SAM2 propagation: every frame is encoded once per
+prompt group, and a prompt frame encoded by segment_single_frame(...,
+keep_features=True) is not encoded again. Runs a small, randomly
+initialised SAM2 on CPU.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("sam2")
+cv2 = pytest.importorskip("cv2")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracker  # noqa: E402
+from frames import ImageSequence  # noqa: E402
+
+NUM_FRAMES = 5
+
+
+@pytest.fixture
+def sam2_model(monkeypatch):
+    from sam2.build_sam import build_sam2_video_predictor
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+    torch.manual_seed(0)
+    predictor = build_sam2_video_predictor("configs/sam2.1/sam2.1_hiera_t.yaml", None, device="cpu",
+                                           hydra_overrides_extra=["++model.image_size=256"])
+    image_predictor = SAM2ImagePredictor(predictor)
+    image_predictor._bb_feat_sizes = [(64, 64), (32, 32), (16, 16)]
+    monkeypatch.setitem(tracker._model_cache, "predictor", predictor)
+    monkeypatch.setitem(tracker._model_cache, "image_predictor", image_predictor)
+    monkeypatch.setattr(tracker, "_prompt_features", type(tracker._prompt_features)())
+
+    # Record (inference state, frame) for every encode; None for prompt encodes
+    encodes = []
+    current = {}
+    get_image_feature = type(predictor)._get_image_feature
+    forward_image = predictor.forward_image
+
+    def recording_get_image_feature(self, inference_state, frame_idx, batch_size):
+        current["frame"] = (id(inference_state), frame_idx)
+        try:
+            return get_image_feature(self, inference_state, frame_idx, batch_size)
+        finally:
+            current.clear()
+
+    def recording_forward_image(image):
+        encodes.append(current.get("frame"))
+        return forward_image(image)
+
+    monkeypatch.setattr(type(predictor), "_get_image_feature", recording_get_image_feature)
+    monkeypatch.setattr(predictor, "forward_image", recording_forward_image)
+    return encodes
+
+
+@pytest.fixture
+def frames(tmp_path):
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(NUM_FRAMES):
+        image = rng.randint(0, 255, (48, 64, 3)).astype(np.uint8)
+        cv2.rectangle(image, (10 + 4 * i, 12), (30 + 4 * i, 36), (255, 255, 255), -1)
+        path = str(tmp_path / "frame_{:03d}.png".format(i))
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return ImageSequence(paths)
+
+
+def _encodes_per_group(sam2_model, frames, click_points):
+    initial_masks = {}
+    for pt in click_points:
+        initial_masks.update(tracker.segment_single_frame(
+            frames.bgr(pt["frame_index"]), [pt], keep_features=True))
+    list(tracker.iter_propagated_masks(frames, initial_masks, click_points))
+
+    groups = {}
+    for encode in sam2_model:
+        if encode is not None:
+            state, frame_idx = encode
+            groups.setdefault(state, []).append(frame_idx)
+    return sam2_model.count(None), list(groups.values())
+
+
+def test_prompt_frame_encoded_once(sam2_model, frames):
+    click_points = [{"x": 20, "y": 24, "object_id": 0, "frame_index": 0}]
+    prompts, groups = _encodes_per_group(sam2_model, frames, click_points)
+    assert prompts == 1
+    assert groups == [[1, 2, 3, 4]]
+
+
+def test_each_group_encodes_each_frame_once(sam2_model, frames):
+    click_points = [{"x": 20, "y": 24, "object_id": 0, "frame_index": 0},
+                    {"x": 28, "y": 24, "object_id": 1, "frame_index": 2}]
+    prompts, groups = _encodes_per_group(sam2_model, frames, click_points)
+    assert prompts == 2
+    assert sorted(sorted(frames_encoded) for frames_encoded in groups) == [[0, 1, 3, 4], [1, 2, 3, 4]]
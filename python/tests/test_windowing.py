@@ -0,0 +1,104 @@
+"""
+Window, overlap and reseed arithmetic of windowed propagation
+(_windowing and _sam2_propagate), on a fake predictor instead of SAM2.
+"""
+
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker import _windowing, _sam2_propagate  # noqa: E402
+
+
+class FakePredictor(object):
+    """Tracks one object as the same square on every frame and records reseeds."""
+
+    image_size = 64
+    mem_dim = 64
+
+    def __init__(self):
+        self.reseeds = []
+        self.windows = []
+
+    def reset_state(self, state):
+        state["obj_ids"] = []
+
+    def add_new_mask(self, state, frame_idx, obj_id, mask):
+        self.reseeds.append(frame_idx)
+        state["obj_ids"] = [obj_id]
+
+    def propagate_in_video(self, state, start_frame_idx, max_frame_num_to_track, reverse=False):
+        step = -1 if reverse else 1
+        last = 0 if reverse else state["num_frames"] - 1
+        end = start_frame_idx + step * max_frame_num_to_track
+        end = max(end, last) if reverse else min(end, last)
+        self.windows.append((start_frame_idx, end))
+        logits = -torch.ones(1, 1, 16, 16)
+        logits[:, :, 4:12, 4:12] = 1.0
+        for frame_idx in range(start_frame_idx, end + step, step):
+            yield frame_idx, list(state["obj_ids"]), logits
+
+
+def _run(total, window, overlap, start=0, reverse=False):
+    predictor = FakePredictor()
+    state = {"num_frames": total, "obj_ids": [0]}
+    windowing = _windowing(predictor, {"window_frames": window, "window_overlap": overlap}, 1)
+    frames = [frame_idx for frame_idx, masks in
+              _sam2_propagate(predictor, state, start, {0: None}, windowing, reverse=reverse)]
+    return frames, predictor
+
+
+def test_windowing_from_config():
+    assert _windowing(FakePredictor(), {}, 1) == (0, 0, 0.0)
+    assert _windowing(FakePredictor(), {"window_frames": 1}, 1) == (2, 0, 0.8)
+    # Overlap always leaves at least two new frames per window
+    assert _windowing(FakePredictor(), {"window_frames": 5, "window_overlap": 8}, 1)[:2] == (5, 3)
+    assert _windowing(FakePredictor(), {"window_frames": 8, "window_overlap": 0, "stitch_iou": 0.5}, 1) == (8, 0, 0.5)
+
+
+def test_clip_shorter_than_window():
+    frames, predictor = _run(total=5, window=8, overlap=2)
+    assert frames == list(range(5))
+    assert predictor.windows == [(0, 4)]
+    assert predictor.reseeds == []
+
+
+def test_clip_equal_to_window():
+    frames, predictor = _run(total=8, window=8, overlap=2)
+    assert frames == list(range(8))
+    assert predictor.windows == [(0, 7)]
+    assert predictor.reseeds == []
+
+
+def test_windows_reseed_overlap_before_end():
+    frames, predictor = _run(total=20, window=8, overlap=2)
+    assert frames == list(range(20))
+    assert predictor.windows == [(0, 7), (5, 12), (10, 17), (15, 19)]
+    assert predictor.reseeds == [5, 10, 15]
+
+
+def test_tail_shorter_than_overlap():
+    # window < 2 * overlap: each reseed frame was yielded one window before the last
+    frames, predictor = _run(total=12, window=5, overlap=3)
+    assert frames == list(range(12))
+    assert predictor.windows == [(0, 4), (1, 5), (2, 6), (3, 7), (4, 8), (5, 9), (6, 10), (7, 11)]
+    assert predictor.reseeds == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_overlap_zero():
+    frames, predictor = _run(total=10, window=4, overlap=0)
+    assert frames == list(range(10))
+    assert predictor.windows == [(0, 3), (3, 6), (6, 9)]
+    assert predictor.reseeds == [3, 6]
+
+
+def test_reverse_windows():
+    frames, predictor = _run(total=20, window=8, overlap=2, start=12, reverse=True)
+    assert frames == list(range(12, -1, -1))
+    assert predictor.windows == [(12, 5), (7, 0)]
+    assert predictor.reseeds == [7]
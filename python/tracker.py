@@ -7,13 +7,29 @@ import os
 import sys
 import json
 import glob
+import time
+import hashlib
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 from scipy.ndimage import center_of_mass
 
+from frames import STORE_NAME, DEFAULT_PREFETCH_DEPTH, prefetch, stage_frames
+from masks import PackedMask
+from model_registry import load_sam2_model, model_variant, artifact_dir
+
 # Module-level model cache
 _model_cache = {}
 
+# Inference precision, torch.compile mode and picking backend, set from the run config
+_inference = {"precision": "fp32", "compile": None,
+              "backend": (os.environ.get("SUPERTRACERY_BACKEND") or "torch").lower(),
+              "int8_frames": 4, "int8_min_iou": 0.9}
+_AUTOCAST_DTYPES = {"bf16": "bfloat16", "fp16": "float16"}
+_BACKENDS = ("torch", "onnx")
+
 
 def _get_device():
     """Detect best available device: CUDA > MPS (Apple Silicon) > CPU."""
@@ -28,8 +44,179 @@ def _get_device():
     return "cpu"
 
 
+def configure_inference(options):
+    """
+    Set precision ("fp32", "bf16", "fp16", "int8"), compile (false, true or a
+    torch.compile mode) and backend ("torch", "onnx") from the run config.
+    Applies to models loaded after.
+    """
+    precision = str(options.get("precision") or "fp32").lower()
+    if precision not in ("fp32", "int8") + tuple(_AUTOCAST_DTYPES):
+        print("INFO:Unknown precision '{}', using fp32".format(precision), flush=True)
+        precision = "fp32"
+    if precision == "int8" and _get_device() != "cpu":
+        # Dynamic int8 kernels only exist for CPU
+        print("INFO:int8 runs on CPU only, using fp32 on " + _get_device(), flush=True)
+        precision = "fp32"
+    if precision in _AUTOCAST_DTYPES:
+        try:
+            import torch
+            torch.autocast(_get_device(), dtype=getattr(torch, _AUTOCAST_DTYPES[precision]))
+        except Exception as e:
+            print("INFO:{} autocast unavailable ({}), using fp32".format(precision, str(e)[:80]), flush=True)
+            precision = "fp32"
+    _inference["precision"] = precision
+    _inference["int8_frames"] = int(options.get("int8_frames", 4))
+    _inference["int8_min_iou"] = float(options.get("int8_min_iou", 0.9))
+
+    compile_mode = options.get("compile") or None
+    _inference["compile"] = "default" if compile_mode is True else compile_mode
+
+    backend = str(options.get("backend") or _inference["backend"]).lower()
+    if backend not in _BACKENDS:
+        print("INFO:Unknown backend '{}', using torch".format(backend), flush=True)
+        backend = "torch"
+    _inference["backend"] = backend
+
+
+def inference_context():
+    """inference_mode, plus autocast to the configured precision."""
+    import torch
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    precision = _inference["precision"]
+    if precision in _AUTOCAST_DTYPES:
+        stack.enter_context(torch.autocast(_get_device(), dtype=getattr(torch, _AUTOCAST_DTYPES[precision])))
+    return stack
+
+
+def _stepwise(frames_iter):
+    """
+    Advance a SAM2 generator under inference_context one step at a time, so
+    the context never stays entered while the consumer runs.
+    """
+    try:
+        while True:
+            with inference_context():
+                try:
+                    item = next(frames_iter)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        frames_iter.close()
+
+
+def _prepare_model(model, device, label):
+    """
+    Quantize and/or compile the image encoder if configured and run a
+    one-shot warm-up forward pass, then report the inference mode in use.
+    model: SAM2Base (the video predictor, or an image predictor's .model)
+    """
+    import torch
+    if _inference["precision"] == "int8" and not hasattr(model, "_st_fp32_encoder"):
+        try:
+            # Dynamic int8: Linear weights quantized now, activations per call; convs stay fp32.
+            # The fp32 encoder is kept until check_quantization() has compared the two.
+            quantized = torch.ao.quantization.quantize_dynamic(
+                model.image_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+            model._st_fp32_encoder = model.image_encoder
+            model.image_encoder = quantized
+        except Exception as e:
+            print("INFO:int8 quantization unavailable ({}), using fp32".format(str(e)[:80]), flush=True)
+            _inference["precision"] = "fp32"
+
+    compile_mode = _inference["compile"]
+    if compile_mode and not getattr(model, "_st_compiled", False):
+        try:
+            # Keep Inductor's compiled kernels next to the checkpoint they were built for
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", artifact_dir("inductor"))
+            model.image_encoder.forward = torch.compile(
+                model.image_encoder.forward, mode=compile_mode, dynamic=False)
+            model._st_compiled = True
+        except Exception as e:
+            print("INFO:torch.compile unavailable ({}), running eager".format(str(e)[:80]), flush=True)
+            compile_mode = None
+
+    mode = "{} {}".format(_inference["precision"], "compile:" + compile_mode if compile_mode else "eager")
+    if _inference["precision"] != "fp32" or compile_mode:
+        start = time.time()
+        with inference_context():
+            model.forward_image(torch.zeros(1, 3, model.image_size, model.image_size, device=device))
+        print("INFO:Inference mode ({}): {}, warm-up {:.1f}s".format(label, mode, time.time() - start), flush=True)
+    else:
+        print("INFO:Inference mode ({}): {}".format(label, mode), flush=True)
+
+
+def check_quantization(frames, click_points):
+    """
+    With int8 precision, compare the quantized image encoder's masks with
+    fp32 on the shot's own frames: the prompt frames plus int8_frames evenly
+    spaced ones. Every object's click is decoded on each of them with both
+    encoders and the mean mask IoU is reported; below int8_min_iou, or on a
+    shot with no more frames than that, the run goes back to fp32. Call once
+    per run, before the model's first use; the fp32 encoder is released
+    afterwards. No-op at other precisions.
+    click_points: [{x, y, object_id, frame_index}] in frames' local indices
+    """
+    if _inference["precision"] != "int8":
+        return
+    predictor = get_sam2_image_predictor()
+    model = predictor.model if predictor is not None else None
+    if model is None or getattr(model, "_st_fp32_encoder", None) is None:
+        return
+    if not click_points:
+        print("INFO:int8 not checked against fp32 (no clicks)", flush=True)
+        model._st_fp32_encoder = None
+        return
+
+    sample = set(pt.get("frame_index", 0) for pt in click_points)
+    sample.update(np.linspace(0, len(frames) - 1, max(0, _inference["int8_frames"])).round().astype(int).tolist())
+    if len(frames) <= len(sample):
+        # Checking would encode every frame twice, more than int8 could save
+        print("INFO:Shot too short to check int8 against fp32 ({} frame(s)), using fp32".format(len(frames)),
+              flush=True)
+        model.image_encoder = model._st_fp32_encoder
+        model._st_fp32_encoder = None
+        _inference["precision"] = "fp32"
+        return
+    points = np.array([[pt["x"], pt["y"]] for pt in click_points], dtype=np.float32)
+    encoders = (("fp32", model._st_fp32_encoder), ("int8", model.image_encoder))
+    seconds = {"fp32": 0.0, "int8": 0.0}
+    ious = []
+    try:
+        with inference_context():
+            for frame_idx in sorted(sample):
+                rgb = cv2.cvtColor(frames.bgr(frame_idx), cv2.COLOR_BGR2RGB)
+                decoded = {}
+                for name, encoder in encoders:
+                    model.image_encoder = encoder
+                    start = time.time()
+                    predictor.set_image(rgb)
+                    seconds[name] += time.time() - start
+                    decoded[name] = _predict_best(predictor, points, low_res=True)[0]
+                ious.extend(PackedMask.from_dense(a).iou(PackedMask.from_dense(b))
+                            for a, b in zip(decoded["fp32"], decoded["int8"]))
+    finally:
+        model.image_encoder = encoders[1][1]
+        predictor.reset_predictor()
+
+    iou = float(np.mean(ious))
+    print("INFO:int8 check on {} frame(s): mask IoU vs fp32 {:.4f} (delta {:.4f}), encoder {:.1f}x".format(
+        len(sample), iou, 1.0 - iou, seconds["fp32"] / max(seconds["int8"], 1e-6)), flush=True)
+    if iou < _inference["int8_min_iou"]:
+        print("INFO:int8 mask IoU below {}, using fp32".format(_inference["int8_min_iou"]), flush=True)
+        model.image_encoder = encoders[0][1]
+        _inference["precision"] = "fp32"
+    # Only one encoder is needed from here on
+    model._st_fp32_encoder = None
+
+
 def get_sam2_predictor():
-    """Lazy-load SAM2 video predictor with fallback to smaller model."""
+    """
+    Lazy-load the shared SAM2 model for the configured variant. It is a
+    SAM2VideoPredictor; the image predictor wraps the same instance.
+    """
     if "predictor" in _model_cache:
         return _model_cache["predictor"]
 
@@ -37,21 +224,17 @@ def get_sam2_predictor():
     print("INFO:Using device: " + device, flush=True)
 
     try:
-        from sam2.sam2_video_predictor import SAM2VideoPredictor
-
         try:
-            predictor = SAM2VideoPredictor.from_pretrained("facebook/sam2-hiera-large", device=device)
-            print("INFO:Loaded sam2-hiera-large", flush=True)
-        except Exception as e1:
-            print("INFO:Large model failed (" + str(e1)[:80] + "), trying small...", flush=True)
-            try:
-                predictor = SAM2VideoPredictor.from_pretrained("facebook/sam2-hiera-small", device=device)
-                print("INFO:Loaded sam2-hiera-small", flush=True)
-            except Exception as e2:
-                print("INFO:Small model also failed: " + str(e2)[:80], flush=True)
-                _model_cache["predictor"] = None
-                return None
-
+            predictor = load_sam2_model(device)
+            print("INFO:Loaded SAM2 " + model_variant(), flush=True)
+        except ImportError:
+            raise
+        except Exception as e:
+            print("INFO:SAM2 model unavailable (" + str(e)[:160] + "), using fallback segmentation", flush=True)
+            _model_cache["predictor"] = None
+            return None
+
+        _prepare_model(predictor, device, "shared")
         _model_cache["predictor"] = predictor
         return predictor
 
@@ -62,33 +245,70 @@ def get_sam2_predictor():
 
 
 def get_sam2_image_predictor():
-    """Lazy-load SAM2 image predictor for single-frame segmentation."""
+    """
+    Lazy-load SAM2 image predictor for single-frame segmentation, on top of
+    the video predictor's model so the weights are only loaded once.
+    """
     if "image_predictor" in _model_cache:
         return _model_cache["image_predictor"]
 
-    device = _get_device()
+    model = get_sam2_predictor()
+    if model is None:
+        _model_cache["image_predictor"] = None
+        return None
+
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+    predictor = SAM2ImagePredictor(model)
+    _model_cache["image_predictor"] = predictor
+    return predictor
+
+
+def get_onnx_image_predictor():
+    """
+    Lazy-load the ONNX Runtime image predictor for the configured variant.
+    The first use exports and checks it (see onnx_backend), later runs load
+    the cached export without loading the torch model at all. A failed check
+    is remembered, so later runs go straight to torch.
+    Returns None if onnxruntime is missing or the export fails its check.
+    """
+    if "onnx_predictor" in _model_cache:
+        return _model_cache["onnx_predictor"]
 
+    predictor = None
     try:
-        from sam2.sam2_image_predictor import SAM2ImagePredictor
+        import onnxruntime
+        from onnx_backend import OnnxImagePredictor, export_sam2_onnx, export_failed, has_export
+        out_dir = artifact_dir("onnx")
+        failed = export_failed(out_dir)
+        if failed:
+            raise RuntimeError("earlier export failed its check: " + failed)
+        if not has_export(out_dir):
+            model = get_sam2_predictor()
+            if model is not None:
+                export_sam2_onnx(model, out_dir)
+        if has_export(out_dir):
+            predictor = OnnxImagePredictor(out_dir)
+            print("INFO:Inference mode (picking): onnxruntime {} cpu fp32".format(onnxruntime.__version__),
+                  flush=True)
+    except ImportError as ie:
+        print("INFO:ONNX Runtime not available (" + str(ie) + "), picking with torch", flush=True)
+    except Exception as e:
+        print("INFO:ONNX backend unavailable (" + str(e)[:160] + "), picking with torch", flush=True)
 
-        try:
-            predictor = SAM2ImagePredictor.from_pretrained("facebook/sam2-hiera-large", device=device)
-            print("INFO:Loaded SAM2 image predictor (large)", flush=True)
-        except Exception:
-            try:
-                predictor = SAM2ImagePredictor.from_pretrained("facebook/sam2-hiera-small", device=device)
-                print("INFO:Loaded SAM2 image predictor (small)", flush=True)
-            except Exception as e2:
-                print("INFO:SAM2 image predictor failed: " + str(e2)[:80], flush=True)
-                _model_cache["image_predictor"] = None
-                return None
-
-        _model_cache["image_predictor"] = predictor
-        return predictor
+    _model_cache["onnx_predictor"] = predictor
+    return predictor
 
-    except ImportError:
-        _model_cache["image_predictor"] = None
-        return None
+
+def get_picking_predictor():
+    """
+    Image predictor for click picking: the ONNX Runtime one with backend
+    "onnx" when it is usable, else get_sam2_image_predictor().
+    """
+    if _inference["backend"] == "onnx":
+        predictor = get_onnx_image_predictor()
+        if predictor is not None:
+            return predictor
+    return get_sam2_image_predictor()
 
 
 def load_frames(frames_dir):
@@ -104,39 +324,43 @@ def load_frames(frames_dir):
         pattern = os.path.join(frames_dir, "*.png")
         paths = sorted(glob.glob(pattern))
     if not paths:
-        # Last resort: any file
+        # Last resort: any file (except our own frame store)
         pattern = os.path.join(frames_dir, "*")
-        paths = sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+        paths = sorted(p for p in glob.glob(pattern)
+                       if os.path.isfile(p) and not p.startswith(os.path.join(frames_dir, STORE_NAME)))
     return paths
 
 
-def segment_single_frame(image_path, click_points):
+def segment_single_frame(image, click_points, keep_features=False, low_res=False):
     """
     Segment objects in a single frame using SAM2 image predictor.
+    image: BGR frame (e.g. frames.bgr(0))
     click_points: list of {"x": int, "y": int, "object_id": int}
+    keep_features: encode the frame exactly as propagation will and keep its
+                   backbone features, so propagating from this frame does not
+                   run the image encoder on it a second time; always uses the
+                   torch model, other calls use the picking backend
+    low_res: return masks at the mask decoder's resolution (256x256 for
+             SAM2's 1024 input) instead of frame size; SAM2 only, the
+             fallback always returns frame-sized masks
     Returns dict of object_id -> binary mask (H, W).
     """
-    predictor = get_sam2_image_predictor()
-    image = cv2.imread(image_path)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    predictor = get_sam2_image_predictor() if keep_features else get_picking_predictor()
 
     masks = {}
 
     if predictor is not None:
-        predictor.set_image(image_rgb)
-
-        for pt in click_points:
-            point_coords = np.array([[pt["x"], pt["y"]]], dtype=np.float32)
-            point_labels = np.array([1], dtype=np.int32)  # foreground
-
-            pred_masks, scores, _ = predictor.predict(
-                point_coords=point_coords,
-                point_labels=point_labels,
-                multimask_output=True
-            )
-            # Take highest-scoring mask
-            best_idx = np.argmax(scores)
-            masks[pt["object_id"]] = pred_masks[best_idx].astype(np.uint8)
+        with inference_context():
+            if keep_features:
+                _set_image_features(predictor, image)
+            else:
+                predictor.set_image(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+            if click_points:
+                points = np.array([[pt["x"], pt["y"]] for pt in click_points], dtype=np.float32)
+                pred_masks, _ = _predict_best(predictor, points, low_res)
+                for pt, mask in zip(click_points, pred_masks):
+                    masks[pt["object_id"]] = mask
     else:
         # Fallback: simple flood-fill based segmentation
         masks = _fallback_segment(image, click_points)
@@ -144,116 +368,755 @@ def segment_single_frame(image_path, click_points):
     return masks
 
 
-def _prepare_sam2_frames(frame_paths):
-    """Create a temp directory with SAM2-compatible filenames.
-    SAM2's video predictor expects numbered .jpg files (e.g. 00000.jpg).
-    Our frames are PNG with non-standard names from AE's render queue.
-    We symlink them with the expected naming convention.
+def _predict_best(predictor, points, low_res=False):
+    """
+    Decode one positive click per object in a single batched pass through
+    the prompt encoder and mask decoder of an image predictor with its image
+    set. Only each object's highest-scoring candidate is upsampled.
+    points: (N, 2) float32 frame coordinates
+    Returns (masks, scores): (N, H, W) uint8 0/1 masks, at frame size or the
+    decoder's resolution with low_res, and (N,) float32 predicted IoU scores.
+    """
+    if hasattr(predictor, "predict_best"):
+        # ONNX Runtime predictors decode on their own session
+        return predictor.predict_best(points, low_res)
+
+    import torch
+    model = predictor.model
+    device = predictor.device
+    orig_hw = predictor._orig_hw[-1]
+
+    coords = predictor._transforms.transform_coords(
+        torch.as_tensor(points[:, None, :], dtype=torch.float, device=device), normalize=True, orig_hw=orig_hw)
+    labels = torch.ones(coords.shape[:2], dtype=torch.int, device=device)
+    sparse_embeddings, dense_embeddings = model.sam_prompt_encoder(points=(coords, labels), boxes=None, masks=None)
+    low_res_masks, iou_predictions, _, _ = model.sam_mask_decoder(
+        image_embeddings=predictor._features["image_embed"][-1].unsqueeze(0),
+        image_pe=model.sam_prompt_encoder.get_dense_pe(),
+        sparse_prompt_embeddings=sparse_embeddings,
+        dense_prompt_embeddings=dense_embeddings,
+        multimask_output=True,
+        repeat_image=len(points) > 1,
+        high_res_features=[feat[-1].unsqueeze(0) for feat in predictor._features["high_res_feats"]],
+    )
+
+    # Best of the 3 candidates per object, picked before any upsampling
+    rows = torch.arange(len(points), device=low_res_masks.device)
+    best = iou_predictions.argmax(dim=1)
+    logits = low_res_masks[rows, best].unsqueeze(1)
+    if not low_res:
+        logits = predictor._transforms.postprocess_masks(logits, orig_hw)
+    masks = (logits[:, 0] > predictor.mask_threshold).to(torch.uint8).cpu().numpy()
+    return masks, iou_predictions[rows, best].float().cpu().numpy()
+
+
+# Backbone features of recent prompt frames, keyed by a hash of the model input.
+# Each entry holds a full feature pyramid, so only a few are kept.
+_prompt_features = OrderedDict()
+_PROMPT_FEATURES_MAX = 4
+
+
+def _sam2_rgb(image, size):
+    """BGR frame -> RGB uint8 at SAM2's square input size."""
+    if image.shape[:2] != (size, size):
+        # INTER_AREA is the closest match to the antialiased PIL resize SAM2 uses
+        image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _features_key(rgb):
+    return hashlib.blake2b(np.ascontiguousarray(rgb), digest_size=16).digest()
+
+
+def _set_image_features(predictor, image):
     """
-    import tempfile
-    sam2_dir = tempfile.mkdtemp(prefix="sam2_frames_")
-    for i, path in enumerate(frame_paths):
-        dst = os.path.join(sam2_dir, "{:05d}.jpg".format(i))
-        os.symlink(os.path.abspath(path), dst)
-    print("INFO:Prepared {} frames for SAM2 in {}".format(len(frame_paths), sam2_dir), flush=True)
-    return sam2_dir
+    set_image() for a BGR frame, preprocessed the way SAM2FrameSource feeds
+    the video predictor. The backbone output is kept in _prompt_features for
+    _take_prompt_features() to hand to the propagation state.
+    """
+    import torch
+    model = predictor.model
+    rgb = _sam2_rgb(image, model.image_size)
+    mean = torch.tensor(SAM2FrameSource.MEAN, dtype=torch.float32)[:, None, None]
+    std = torch.tensor(SAM2FrameSource.STD, dtype=torch.float32)[:, None, None]
+    tensor = (torch.from_numpy(rgb).permute(2, 0, 1).float() / 255.0 - mean) / std
+    tensor = tensor.unsqueeze(0).to(predictor.device)
+
+    backbone_out = model.forward_image(tensor)
+    _use_backbone_features(predictor, backbone_out, image.shape[:2])
+
+    _prompt_features[_features_key(rgb)] = (tensor, backbone_out)
+    while len(_prompt_features) > _PROMPT_FEATURES_MAX:
+        _prompt_features.popitem(last=False)
+
+
+def _use_backbone_features(predictor, backbone_out, orig_hw):
+    """Set an image predictor's image from forward_image() output for a frame of size orig_hw."""
+    model = predictor.model
+    predictor.reset_predictor()
+    predictor._orig_hw = [tuple(orig_hw)]
+
+    # Same as the tail of SAM2ImagePredictor.set_image()
+    _, vision_feats, _, _ = model._prepare_backbone_features(backbone_out)
+    if model.directly_add_no_mem_embed:
+        vision_feats[-1] = vision_feats[-1] + model.no_mem_embed
+    feats = [
+        feat.permute(1, 2, 0).view(1, -1, *feat_size)
+        for feat, feat_size in zip(vision_feats[::-1], predictor._bb_feat_sizes[::-1])
+    ][::-1]
+    predictor._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
+    predictor._is_image_set = True
+
+
+def _take_prompt_features(inference_state, source, frame_idx):
+    """Seed a fresh inference state with features kept for frame_idx, if any."""
+    cached = _prompt_features.pop(_features_key(source._load(frame_idx)), None)
+    if cached is not None:
+        inference_state["cached_features"] = {frame_idx: cached}
+    return cached is not None
+
+
+class SAM2FrameSource(object):
+    """
+    Frame sequence handed to SAM2VideoPredictor in place of the image tensor
+    init_state() would normally load for the whole clip up front.
+    Frames are decoded, resized and normalised when the predictor asks for
+    them. Only a small sliding window of resized uint8 frames is kept, filled
+    a few frames ahead in the direction of travel by worker threads, so peak
+    memory does not grow with clip length.
+    """
+
+    # ImageNet statistics, as used by SAM2's own frame loader
+    MEAN = (0.485, 0.456, 0.406)
+    STD = (0.229, 0.224, 0.225)
+
+    def __init__(self, frames, image_size, window=8, depth=DEFAULT_PREFETCH_DEPTH):
+        import torch
+        self.frames = frames
+        self.image_size = image_size
+        self.window = max(2, int(window))
+        self.depth = max(0, min(int(depth), self.window - 2))
+        self._mean = torch.tensor(self.MEAN, dtype=torch.float32)[:, None, None]
+        self._std = torch.tensor(self.STD, dtype=torch.float32)[:, None, None]
+        self._slots = OrderedDict()  # frame idx -> future of resized RGB uint8
+        self._pool = ThreadPoolExecutor(max_workers=max(1, self.depth))
+        self._last = -1
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, idx):
+        import torch
+        if idx < 0:
+            idx += len(self)
+        step = -1 if idx < self._last else 1
+        self._last = idx
+
+        slot = self._slots.pop(idx, None) or self._pool.submit(self._load, idx)
+        self._slots[idx] = slot
+        for ahead in range(1, self.depth + 1):
+            nxt = idx + step * ahead
+            if 0 <= nxt < len(self) and nxt not in self._slots:
+                self._slots[nxt] = self._pool.submit(self._load, nxt)
+        while len(self._slots) > self.window:
+            self._slots.popitem(last=False)
+
+        image = torch.from_numpy(slot.result()).permute(2, 0, 1).float() / 255.0
+        return (image - self._mean) / self._std
+
+    def _load(self, idx):
+        return _sam2_rgb(self.frames.bgr(idx), self.image_size)
+
+    def close(self):
+        self._slots.clear()
+        self._pool.shutdown(wait=False)
 
 
-def propagate_masks(frames_dir, frame_paths, initial_masks, click_points):
+def _init_sam2_state(predictor, frames, prefetch_depth=DEFAULT_PREFETCH_DEPTH):
     """
-    Propagate masks across all video frames using SAM2 video predictor.
-    initial_masks: dict of object_id -> mask for first frame
-    Returns: dict of object_id -> list of masks per frame
+    init_state() on any frame source, backed by a lazy SAM2FrameSource.
+    SAM2's directory loader is swapped out for the duration of the call, and
+    so is its warm-up encode of frame 0: frames are encoded when first used,
+    after _take_prompt_features() has had a chance to seed the prompt frame.
+    Returns (inference_state, source); close the source when done.
     """
-    predictor = get_sam2_predictor()
-    total_frames = len(frame_paths)
+    import sam2.sam2_video_predictor as video_module
 
-    all_masks = {}
-    for obj_id in initial_masks:
-        all_masks[obj_id] = [None] * total_frames
+    source = SAM2FrameSource(frames, predictor.image_size, depth=prefetch_depth)
+    # Masks come back at the source (comp) size, even for staged frames
+    video_h, video_w = frames.shape
+
+    original_loader = video_module.load_video_frames
+    video_module.load_video_frames = lambda **kwargs: (source, video_h, video_w)
+    predictor._get_image_feature = lambda *args, **kwargs: None
+    try:
+        with inference_context():
+            return predictor.init_state(video_path="<frames>"), source
+    except Exception:
+        source.close()
+        raise
+    finally:
+        del predictor._get_image_feature
+        video_module.load_video_frames = original_loader
 
-    if predictor is not None:
-        # SAM2 expects numbered .jpg files — prepare a compatible directory
-        sam2_dir = _prepare_sam2_frames(frame_paths)
-        inference_state = predictor.init_state(video_path=sam2_dir)
 
-        # Add prompts for each object on the first frame
-        for pt in click_points:
-            obj_id = pt["object_id"]
-            points = np.array([[pt["x"], pt["y"]]], dtype=np.float32)
-            labels = np.array([1], dtype=np.int32)
+# Backward tracking stops once an object's mask has been empty this many frames in a row
+_ABSENT_STOP_FRAMES = 3
 
-            _, out_obj_ids, out_mask_logits = predictor.add_new_points_or_box(
+
+class _Progress(object):
+    """PROGRESS:N/TOTAL reporting over a known number of steps."""
+
+    def __init__(self, total):
+        self.done = 0
+        self.total = max(1, total)
+
+    def advance(self, n=1):
+        self.done = min(self.total, self.done + n)
+        print("PROGRESS:{}/{}".format(self.done, self.total), flush=True)
+
+
+class _ObjectExits(object):
+    """
+    Per-object exit detection for one forward propagation pass.
+    An object whose mask has been empty for exit_frames frames in a row
+    (SAM2 empties the mask itself when its object score is low) has left the
+    shot: it is removed from the inference state and reported as absent.
+    With redetect_every, exited objects are searched for again every that
+    many frames by matching their last seen appearance against the frame,
+    and re-added to the state from a fresh single-frame segmentation.
+    """
+
+    # Re-detection matches templates on frames downscaled to this long side
+    MATCH_SIZE = 480
+
+    def __init__(self, frames, options):
+        self.frames = frames
+        self.exit_frames = int(options.get("exit_frames") or 0)
+        self.redetect_every = int(options.get("redetect_every") or 0)
+        self.redetect_score = float(options.get("redetect_score", 0.8))
+        h, w = frames.shape
+        self.match_scale = min(1.0, self.MATCH_SIZE / float(max(h, w)))
+        self.absent = {}     # object_id -> empty frames in a row
+        self.last_seen = {}  # object_id -> (frame_idx, PackedMask) of its last non-empty mask
+        self.gone = {}       # object_id -> (exit frame_idx, downscaled luma template or None)
+
+    def update(self, frame_idx, masks):
+        """Record one frame's masks. Returns the object ids that exit on it."""
+        exited = []
+        for obj_id, mask in masks.items():
+            if mask.area:
+                self.absent[obj_id] = 0
+                self.last_seen[obj_id] = (frame_idx, mask)
+                continue
+            self.absent[obj_id] = self.absent.get(obj_id, 0) + 1
+            if self.absent[obj_id] >= self.exit_frames:
+                self.gone[obj_id] = (frame_idx, self._template(obj_id))
+                exited.append(obj_id)
+        return exited
+
+    def _template(self, obj_id):
+        if not self.redetect_every or obj_id not in self.last_seen:
+            return None
+        frame_idx, mask = self.last_seen[obj_id]
+        gray = self.frames.luma(frame_idx)
+        if gray is None:
+            return None
+        x0, y0, x1, y1 = mask.bbox
+        template = self._scaled(gray[y0:y1, x0:x1])
+        return template if min(template.shape) >= 8 else None
+
+    def _scaled(self, gray):
+        if self.match_scale == 1.0:
+            return gray
+        h, w = gray.shape
+        size = (max(1, int(round(w * self.match_scale))), max(1, int(round(h * self.match_scale))))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def redetect(self, frame_idx):
+        """[(object_id, (x, y))] for exited objects whose appearance is found on frame_idx."""
+        found = []
+        gray = None
+        for obj_id, (exit_idx, template) in self.gone.items():
+            if template is None or (frame_idx - exit_idx) % self.redetect_every:
+                continue
+            if gray is None:
+                gray = self.frames.luma(frame_idx)
+                if gray is None:
+                    return found
+                gray = self._scaled(gray)
+            if template.shape[0] > gray.shape[0] or template.shape[1] > gray.shape[1]:
+                continue
+            _, score, _, (x, y) = cv2.minMaxLoc(cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED))
+            if score >= self.redetect_score:
+                th, tw = template.shape
+                found.append((obj_id, ((x + tw / 2.0) / self.match_scale, (y + th / 2.0) / self.match_scale)))
+        return found
+
+    def remove(self, predictor, inference_state, obj_ids):
+        with inference_context():
+            for obj_id in obj_ids:
+                predictor.remove_object(inference_state, obj_id, need_output=False)
+        print("INFO:Object(s) {} left the shot, no longer tracked".format(
+            ", ".join(str(i) for i in obj_ids)), flush=True)
+
+    def readd(self, predictor, inference_state, frame_idx, found):
+        """Segment re-detected objects on frame_idx and add them back. Returns True if any were."""
+        image_predictor = get_sam2_image_predictor()
+        added = []
+        with inference_context():
+            _, backbone_out = inference_state["cached_features"].get(frame_idx, (None, None))
+            if backbone_out is not None:
+                _use_backbone_features(image_predictor, backbone_out,
+                                       (inference_state["video_height"], inference_state["video_width"]))
+            else:
+                _set_image_features(image_predictor, self.frames.bgr(frame_idx))
+                _take_prompt_features(inference_state, inference_state["images"], frame_idx)
+            points = np.array([xy for _, xy in found], dtype=np.float32)
+            masks, _ = _predict_best(image_predictor, points)
+            for (obj_id, _), mask in zip(found, masks):
+                if not mask.any():
+                    continue
+                predictor.add_new_mask(inference_state, frame_idx=frame_idx, obj_id=obj_id, mask=mask > 0)
+                del self.gone[obj_id]
+                self.absent[obj_id] = 0
+                added.append(obj_id)
+        if added:
+            print("INFO:Object(s) {} re-detected at frame {}".format(
+                ", ".join(str(i) for i in added), frame_idx), flush=True)
+        return bool(added)
+
+
+def _prompt_frames(click_points):
+    """object_id -> frame index the object was picked on (default 0)."""
+    return {pt["object_id"]: int(pt.get("frame_index", 0)) for pt in click_points}
+
+
+def _logits_to_masks(obj_ids, mask_logits, keep, low_res_logits=None):
+    """
+    Threshold SAM2's video-resolution mask logits into PackedMasks.
+    Area, bbox and centroid are measured with batched reductions on the
+    logits' device; only those numbers and each mask's bbox crop are copied
+    back, never the full frame.
+    low_res_logits: the same objects' low-resolution logits; if given, each
+    mask's outline is contoured from them (see _logits_to_polygon).
+    """
+    import torch
+    rows_kept = [i for i, obj_id in enumerate(obj_ids) if obj_id in keep]
+    if not rows_kept:
+        return {}
+    binary = mask_logits[rows_kept, 0] > 0.0
+    n, h, w = binary.shape
+    device = binary.device
+
+    row_sums = binary.sum(dim=2)
+    col_sums = binary.sum(dim=1)
+    rows_any = row_sums > 0
+    cols_any = col_sums > 0
+    measures = torch.stack([
+        row_sums.sum(dim=1),
+        (col_sums * torch.arange(w, device=device)).sum(dim=1),
+        (row_sums * torch.arange(h, device=device)).sum(dim=1),
+        cols_any.int().argmax(dim=1),
+        rows_any.int().argmax(dim=1),
+        w - cols_any.flip(1).int().argmax(dim=1),
+        h - rows_any.flip(1).int().argmax(dim=1),
+    ], dim=1).tolist()
+
+    masks = {}
+    for i, (area, sum_x, sum_y, x0, y0, x1, y1) in enumerate(measures):
+        obj_id = obj_ids[rows_kept[i]]
+        if not area:
+            masks[obj_id] = PackedMask.empty((h, w))
+            continue
+        crop = binary[i, y0:y1, x0:x1].cpu().numpy()
+        masks[obj_id] = PackedMask((h, w), (x0, y0, x1, y1), np.packbits(crop, axis=None), area,
+                                   centroid=((sum_x - x0 * area) / float(area) + x0,
+                                             (sum_y - y0 * area) / float(area) + y0))
+        if low_res_logits is not None:
+            masks[obj_id].outline = _logits_to_polygon(
+                low_res_logits[rows_kept[i], 0].float().cpu().numpy(), (h, w))
+    return masks
+
+
+def _low_res_logits(inference_state, frame_idx):
+    """Low-resolution mask logits of every object in the state on a frame it has just tracked."""
+    import torch
+    logits = []
+    for obj_idx in range(len(inference_state["obj_ids"])):
+        outputs = inference_state["output_dict_per_obj"][obj_idx]
+        out = outputs["cond_frame_outputs"].get(frame_idx) or outputs["non_cond_frame_outputs"][frame_idx]
+        logits.append(out["pred_masks"])
+    return torch.cat(logits, dim=0)
+
+
+def iter_propagated_masks(frames, initial_masks, click_points, options=None):
+    """
+    Propagate masks across all video frames using SAM2 video predictor.
+    frames: frame source (ImageSequence, FrameStore or VideoFrames)
+    initial_masks: dict of object_id -> mask on that object's prompt frame
+    click_points: [{x, y, object_id, frame_index}]; frame_index is the local
+                  frame the object was picked on (default 0)
+    options: run config; uses prefetch_depth, stage_frames, stage_workers,
+             track_backward, window_frames, window_mb, window_overlap, stitch_iou,
+             exit_frames, redetect_every, redetect_score, roi, roi_margin,
+             roi_min_score, lowres_polygons
+    Each object is tracked backward from its prompt frame until it has been
+    absent for a few frames (unless track_backward is false), then forward
+    to the end, or with exit_frames until it has left the shot. Frames an
+    object was not tracked on have no entry for it.
+    Yields: (frame_idx, {object_id: PackedMask}) in frame order, one frame at a time
+    """
+    options = options or {}
+    prefetch_depth = int(options.get("prefetch_depth", DEFAULT_PREFETCH_DEPTH))
+    predictor = get_sam2_predictor()
+    total_frames = len(frames)
+    prompt_frames = _prompt_frames(click_points)
+    backward = options.get("track_backward", True)
+    outlines = bool(options.get("lowres_polygons", False))
+
+    if predictor is None:
+        # Fallback: optical flow propagation
+        progress = _Progress(total_frames + (max(prompt_frames.values()) if backward else 0))
+        for item in _fallback_propagate(frames, initial_masks, prompt_frames, prefetch_depth, progress,
+                                        backward):
+            yield item
+        return
+
+    if options.get("roi"):
+        # Per-object crops through the image predictor instead of whole-frame video tracking
+        progress = _Progress(total_frames + (max(prompt_frames.values()) if backward else 0))
+        for item in _roi_propagate(frames, initial_masks, prompt_frames, options, progress, backward):
+            yield item
+        return
+
+    # One inference state per prompt frame, so each group of objects starts
+    # tracking where it was picked instead of from the first frame
+    groups = OrderedDict()
+    for pt in sorted(click_points, key=lambda p: prompt_frames[p["object_id"]]):
+        groups.setdefault(prompt_frames[pt["object_id"]], []).append(pt)
+    progress = _Progress(total_frames * len(groups) - (0 if backward else sum(groups)))
+    windowing = _windowing(predictor, options, len(initial_masks))
+    if windowing[0]:
+        print("INFO:Propagating in windows of {} frames ({} overlap)".format(*windowing[:2]), flush=True)
+        if options.get("redetect_every"):
+            print("INFO:redetect_every needs whole-clip propagation, ignored with windows", flush=True)
+
+    # Optionally pre-resize every frame to model resolution up front
+    staged = None
+    if options.get("stage_frames", False):
+        staged = stage_frames(frames, predictor.image_size, options.get("stage_workers"))
+
+    passes = []
+    try:
+        for prompt_idx, points in groups.items():
+            # Frames are decoded on demand from our own source, no image directory needed
+            inference_state, source = _init_sam2_state(
+                predictor, staged if staged is not None else frames, prefetch_depth)
+            sam_pass = {"frame": prompt_idx, "state": inference_state, "source": source,
+                        "forward": None, "reverse": {}}
+            passes.append(sam_pass)
+
+            # The prompt frame was just encoded for segment_single_frame; reuse it
+            _take_prompt_features(inference_state, source, prompt_idx)
+            _add_click_prompts(predictor, inference_state, prompt_idx, points)
+
+            # Backward pass first; its masks are buffered until those frames come up
+            if prompt_idx > 0 and backward:
+                sam_pass["reverse"] = _sam2_reverse_pass(
+                    predictor, inference_state, prompt_idx, initial_masks, windowing, progress, outlines)
+                if windowing[0]:
+                    # Windows reseed the state; start the forward pass from the clicks again
+                    predictor.reset_state(inference_state)
+                    _add_click_prompts(predictor, inference_state, prompt_idx, points)
+
+        # Forward passes run in lockstep so frames come out in order
+        for frame_idx in range(total_frames):
+            masks = {}
+            for sam_pass in passes:
+                if frame_idx < sam_pass["frame"]:
+                    masks.update(sam_pass["reverse"].pop(frame_idx, {}))
+                    continue
+                if sam_pass["forward"] is None:
+                    sam_pass["forward"] = _sam2_propagate(
+                        predictor, sam_pass["state"], sam_pass["frame"], initial_masks, windowing,
+                        exits=_ObjectExits(frames, options) if options.get("exit_frames") else None,
+                        outlines=outlines)
+                masks.update(next(sam_pass["forward"])[1])
+                progress.advance()
+            yield frame_idx, masks
+    finally:
+        for sam_pass in passes:
+            if sam_pass["forward"] is not None:
+                sam_pass["forward"].close()
+            predictor.reset_state(sam_pass["state"])
+            sam_pass["source"].close()
+        if staged is not None:
+            staged.remove()
+
+
+def _add_click_prompts(predictor, inference_state, prompt_idx, points):
+    """Add each object's click as a positive point prompt on prompt_idx."""
+    with inference_context():
+        for pt in points:
+            predictor.add_new_points_or_box(
                 inference_state=inference_state,
-                frame_idx=0,
-                obj_id=obj_id,
-                points=points,
-                labels=labels
+                frame_idx=prompt_idx,
+                obj_id=pt["object_id"],
+                points=np.array([[pt["x"], pt["y"]]], dtype=np.float32),
+                labels=np.array([1], dtype=np.int32)
             )
 
-        # Propagate through video
-        for frame_idx, obj_ids, mask_logits in predictor.propagate_in_video(inference_state):
-            print("PROGRESS:{}/{}".format(frame_idx + 1, total_frames), flush=True)
-            for i, obj_id in enumerate(obj_ids):
-                mask = (mask_logits[i] > 0.0).cpu().numpy().squeeze().astype(np.uint8)
-                if obj_id in all_masks:
-                    all_masks[obj_id][frame_idx] = mask
 
-        predictor.reset_state(inference_state)
-
-        # Clean up temp symlink directory
-        import shutil
+def _windowing(predictor, options, num_objects):
+    """
+    (window, overlap, stitch_iou) for _sam2_propagate from the run config.
+    window_frames sets the window directly; window_mb derives it from a
+    budget for SAM2's per-frame tracking state. window 0 = whole clip.
+    """
+    window = int(options.get("window_frames") or 0)
+    if not window and options.get("window_mb"):
+        side = predictor.image_size
+        # Per tracked frame and object: bf16 memory features at 1/16 and fp32 mask logits at 1/4 resolution
+        per_frame = max(1, num_objects) * (predictor.mem_dim * (side // 16) ** 2 * 2 + (side // 4) ** 2 * 4)
+        window = int(float(options["window_mb"]) * 1024 * 1024 // per_frame)
+    if not window:
+        return 0, 0, 0.0
+    window = max(2, window)
+    overlap = min(max(0, int(options.get("window_overlap", 8))), window - 2)
+    return window, overlap, float(options.get("stitch_iou", 0.8))
+
+
+def _sam2_propagate(predictor, inference_state, start_idx, keep, windowing, reverse=False, exits=None,
+                    outlines=False):
+    """
+    Run propagate_in_video from start_idx to the last frame (or frame 0 when
+    reverse), yielding (frame_idx, {object_id: PackedMask}).
+    With a window, the tracking state is reset every window frames and
+    reseeded with the previous window's masks overlap frames before its end.
+    The new window takes over once its masks on the overlap agree with the
+    previous window's (IoU >= stitch_iou); otherwise it restarts from the
+    previous window's last frame.
+    exits: _ObjectExits for a forward pass. Without a window, exited objects
+    are removed from the state and propagation restarts after the exit frame;
+    with one, they are left out of the results and the next window's seeds.
+    outlines: attach outlines contoured from the low-resolution logits.
+    """
+    window, overlap, stitch_iou = windowing
+    if not window:
+        for item in _sam2_propagate_clip(predictor, inference_state, start_idx, keep, reverse, exits, outlines):
+            yield item
+        return
+
+    step = -1 if reverse else 1
+    last_idx = 0 if reverse else inference_state["num_frames"] - 1
+    first = start_idx
+    done = None  # last frame yielded by the previous window
+    tail = {}    # previous window's masks on its last overlap + 1 frames
+
+    while True:
+        end = max(first - window + 1, last_idx) if reverse else min(first + window - 1, last_idx)
+        if done is not None:
+            predictor.reset_state(inference_state)
+            seeds = {obj_id: mask for obj_id, mask in tail[first].items()
+                     if exits is None or obj_id not in exits.gone}
+            if not seeds:
+                # Every object has left the shot
+                for frame_idx in range(done + step, last_idx + step, step):
+                    yield frame_idx, {}
+                return
+            with inference_context():
+                for obj_id, mask in seeds.items():
+                    predictor.add_new_mask(inference_state, frame_idx=first, obj_id=obj_id, mask=mask.decode() > 0)
+
+        next_tail = {}
+        ious = []
+        restart = False
+        frames_iter = _stepwise(predictor.propagate_in_video(
+            inference_state, start_frame_idx=first, max_frame_num_to_track=window - 1, reverse=reverse))
         try:
-            shutil.rmtree(sam2_dir)
-        except Exception:
-            pass
-    else:
-        # Fallback: optical flow propagation
-        all_masks = _fallback_propagate(frame_paths, initial_masks, total_frames)
+            for frame_idx, obj_ids, mask_logits in frames_iter:
+                masks = _logits_to_masks(obj_ids, mask_logits, keep,
+                                         _low_res_logits(inference_state, frame_idx) if outlines else None)
+                if done is not None and (done - frame_idx) * step >= 0:
+                    # Overlap, already yielded by the previous window
+                    if frame_idx != first:
+                        ious.extend(masks[obj_id].iou(mask) for obj_id, mask in tail[frame_idx].items()
+                                    if obj_id in masks)
+                    if frame_idx == done and ious and min(ious) < stitch_iou:
+                        restart = True
+                        break
+                    if (end - frame_idx) * step <= overlap:
+                        # Windows shorter than twice the overlap reseed from frames yielded earlier
+                        next_tail[frame_idx] = tail[frame_idx]
+                    continue
+                if exits is not None:
+                    masks = {obj_id: mask for obj_id, mask in masks.items() if obj_id not in exits.gone}
+                    exits.update(frame_idx, masks)
+                if (end - frame_idx) * step <= overlap:
+                    next_tail[frame_idx] = masks
+                yield frame_idx, masks
+        finally:
+            frames_iter.close()
+
+        if restart:
+            print("INFO:Window seam at frame {} disagrees (IoU {:.2f}), reseeding there".format(
+                done, min(ious)), flush=True)
+            tail = {done: tail[done]}
+            first = done
+            continue
+        if end == last_idx:
+            return
+        done = end
+        tail = next_tail
+        first = end - overlap * step
+
+
+def _sam2_propagate_clip(predictor, inference_state, start_idx, keep, reverse, exits, outlines):
+    """_sam2_propagate without windowing."""
+    last_idx = 0 if reverse else inference_state["num_frames"] - 1
+    start = start_idx
+    while True:
+        if not inference_state["obj_ids"]:
+            # Every object has left; only look for them coming back
+            for frame_idx in range(start, last_idx + 1):
+                found = exits.redetect(frame_idx) if exits.redetect_every else []
+                if found and exits.readd(predictor, inference_state, frame_idx, found):
+                    break
+                yield frame_idx, {}
+            else:
+                return
+            start = frame_idx
+            continue
 
-    return all_masks
+        exited, readded = [], False
+        frames_iter = _stepwise(
+            predictor.propagate_in_video(inference_state, start_frame_idx=start, reverse=reverse))
+        try:
+            for frame_idx, obj_ids, mask_logits in frames_iter:
+                masks = _logits_to_masks(obj_ids, mask_logits, keep,
+                                         _low_res_logits(inference_state, frame_idx) if outlines else None)
+                if exits is not None:
+                    found = exits.redetect(frame_idx) if exits.gone and exits.redetect_every else []
+                    if found and exits.readd(predictor, inference_state, frame_idx, found):
+                        # Restart on this frame so it comes out with the re-added objects
+                        readded = True
+                        break
+                    exited = exits.update(frame_idx, masks)
+                yield frame_idx, masks
+                if exited:
+                    break
+        finally:
+            frames_iter.close()
+
+        if readded:
+            start = frame_idx
+            continue
+        if not exited or frame_idx == last_idx:
+            return
+        exits.remove(predictor, inference_state, exited)
+        start = frame_idx + 1
 
 
-def analyze_frame(image_path, mask, prev_centroid=None):
+def _sam2_reverse_pass(predictor, inference_state, prompt_idx, keep, windowing, progress, outlines=False):
+    """
+    Track backward from prompt_idx until every object has been absent for
+    _ABSENT_STOP_FRAMES frames. Returns {frame_idx: {object_id: PackedMask}};
+    frames from the trailing absent run on are left out.
+    """
+    buffered = {}
+    absent = 0
+    reverse = _sam2_propagate(predictor, inference_state, prompt_idx, keep, windowing, reverse=True,
+                              outlines=outlines)
+    try:
+        for frame_idx, masks in reverse:
+            if frame_idx == prompt_idx:
+                continue  # the forward pass yields the prompt frame
+            progress.advance()
+            buffered[frame_idx] = masks
+            absent = absent + 1 if not any(m.area for m in masks.values()) else 0
+            if absent >= _ABSENT_STOP_FRAMES:
+                for idx in range(frame_idx, frame_idx + absent):
+                    buffered.pop(idx, None)
+                progress.advance(frame_idx)
+                break
+    finally:
+        reverse.close()
+    return buffered
+
+
+def analyze_frame(gray, mask, prev_centroid=None, scale=1.0, trace_polygon=True):
     """
     Compute per-frame analysis for a single object mask.
+    gray: luma plane of the frame (e.g. frames.luma(idx))
+    mask: PackedMask, or a dense full-frame mask
+    scale: proxy scale the mask was tracked at; measurements are mapped
+           back to comp pixels
+    trace_polygon: false skips contour tracing and leaves "polygon" empty
     Returns dict with centroid, bbox, polygon, area, avg_luma, motion_vector.
     """
-    image = cv2.imread(image_path)
-    h, w = mask.shape[:2]
-
-    # Centroid
-    moments = cv2.moments(mask)
-    if moments["m00"] > 0:
-        cx = moments["m10"] / moments["m00"]
-        cy = moments["m01"] / moments["m00"]
+    if isinstance(mask, PackedMask):
+        # Already measured when packed; only the bbox crop is needed from here on
+        h, w = mask.shape
+        x0, y0 = mask.bbox[:2]
+        crop = mask.crop()
+        area = mask.area
+        if area:
+            cx, cy = mask.centroid()
+            bbox = list(mask.bbox)
+        else:
+            cx, cy = w / 2.0, h / 2.0
+            bbox = [0, 0, w, h]
     else:
-        cx, cy = w / 2.0, h / 2.0
+        h, w = mask.shape[:2]
+        x0, y0 = 0, 0
+        crop = mask
+
+        # Centroid
+        moments = cv2.moments(crop)
+        if moments["m00"] > 0:
+            cx = moments["m10"] / moments["m00"]
+            cy = moments["m01"] / moments["m00"]
+        else:
+            cx, cy = w / 2.0, h / 2.0
+
+        # Bounding box
+        coords = cv2.findNonZero(crop)
+        if coords is not None:
+            x1, y1, bw, bh = cv2.boundingRect(coords)
+            bbox = [int(x1), int(y1), int(x1 + bw), int(y1 + bh)]
+        else:
+            bbox = [0, 0, w, h]
+
+        # Area
+        area = int(np.count_nonzero(crop))
 
     centroid = [round(cx, 2), round(cy, 2)]
 
-    # Bounding box
-    coords = cv2.findNonZero(mask)
-    if coords is not None:
-        x1, y1, bw, bh = cv2.boundingRect(coords)
-        bbox = [int(x1), int(y1), int(x1 + bw), int(y1 + bh)]
+    # Simplified polygon (max 64 points), already contoured from the low-res logits if the tracker did it
+    if not (area and trace_polygon):
+        polygon = []
+    elif getattr(mask, "outline", None) is not None:
+        polygon = mask.outline
     else:
-        bbox = [0, 0, w, h]
-
-    # Area
-    area = int(np.sum(mask > 0))
-
-    # Simplified polygon (max 64 points)
-    polygon = _mask_to_polygon(mask, max_points=64)
+        polygon = _mask_to_polygon(crop, max_points=64, offset=(x0, y0))
 
     # Average luminosity within mask
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    masked_pixels = gray[mask > 0]
+    gray_crop = gray[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]]
+    masked_pixels = gray_crop[crop > 0]
     if len(masked_pixels) > 0:
         avg_luma = round(float(np.mean(masked_pixels)) / 255.0, 4)
     else:
         avg_luma = 0.0
 
+    # Map proxy-resolution measurements back to comp pixels
+    if scale != 1.0:
+        inv = 1.0 / scale
+        centroid = [round(cx * inv, 2), round(cy * inv, 2)]
+        bbox = [int(round(v * inv)) for v in bbox]
+        polygon = [[int(round(x * inv)), int(round(y * inv))] for x, y in polygon]
+        area = int(round(area * inv * inv))
+
     # Motion vector
     if prev_centroid is not None:
         motion_vector = [
@@ -273,29 +1136,63 @@ def analyze_frame(image_path, mask, prev_centroid=None):
     }
 
 
-def _mask_to_polygon(mask, max_points=64):
-    """Convert binary mask to simplified polygon."""
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def _mask_to_polygon(mask, max_points=64, offset=(0, 0)):
+    """Convert binary mask to simplified polygon (offset: position of a cropped mask)."""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                   offset=(int(offset[0]), int(offset[1])))
     if not contours:
         return []
 
     # Take largest contour
     contour = max(contours, key=cv2.contourArea)
+    return _simplify_contour(contour, max_points).tolist()
 
-    # Simplify with increasing epsilon until under max_points
+
+def _simplify_contour(points, max_points):
+    """
+    Closed contour (cv2 layout, (N, 1, 2) int32 or float32) simplified with
+    increasing epsilon until it has at most max_points. Returns (M, 2).
+    """
     epsilon = 2.0
     for _ in range(20):
-        approx = cv2.approxPolyDP(contour, epsilon, True)
+        approx = cv2.approxPolyDP(points, epsilon, True)
         if len(approx) <= max_points:
             break
         epsilon *= 1.5
+    return approx.reshape(-1, 2)
+
+
+def _logits_to_polygon(logits, frame_shape, max_points=64):
+    """
+    Simplified polygon from SAM2's low-resolution mask logits, in frame pixels.
+    The zero level set is contoured with sub-pixel interpolation on the small
+    grid and scaled up, instead of tracing the upsampled full-frame mask.
+    """
+    from skimage.measure import find_contours
+
+    lh, lw = logits.shape
+    # Pad with "outside" so masks touching the border still close
+    padded = np.pad(logits, 1, mode="constant", constant_values=-1.0)
+    contours = find_contours(padded, 0.0)
+    if not contours:
+        return []
+
+    def shoelace(c):
+        return 0.5 * abs(np.dot(c[:, 0], np.roll(c[:, 1], 1)) - np.dot(c[:, 1], np.roll(c[:, 0], 1)))
 
-    polygon = approx.squeeze().tolist()
-    if isinstance(polygon[0], int):
-        # Single point edge case
-        polygon = [polygon]
+    # Take largest contour, (row, col) -> (x, y) on the unpadded grid
+    contour = max(contours, key=shoelace)[:, ::-1] - 1.0
 
-    return polygon
+    # Same pixel-center mapping as SAM2's bilinear upsampling
+    h, w = frame_shape
+    points = np.empty_like(contour)
+    points[:, 0] = (contour[:, 0] + 0.5) * (w / float(lw)) - 0.5
+    points[:, 1] = (contour[:, 1] + 0.5) * (h / float(lh)) - 0.5
+    points = points[:-1].astype(np.float32).reshape(-1, 1, 2)
+    if len(points) == 0:
+        return []
+
+    return [[int(round(x)), int(round(y))] for x, y in _simplify_contour(points, max_points).tolist()]
 
 
 def smooth_motion_vectors(frames_data, window=3):
@@ -324,6 +1221,269 @@ def smooth_motion_vectors(frames_data, window=3):
     return frames_data
 
 
+def copy_held_frames(frames_data, held):
+    """
+    Re-insert results for held frames that were analysed only once.
+    held: dict of comp frame -> comp frame whose image it repeats.
+    Copies keep the original measurements with zero motion.
+    """
+    by_index = {f["frame_index"]: f for f in frames_data}
+    for frame_index, source_index in held.items():
+        frame = dict(by_index[source_index])
+        frame["frame_index"] = frame_index
+        frame["time"] = round(frame_index / 30.0, 6)
+        frame["motion_vector"] = [0.0, 0.0]
+        by_index[frame_index] = frame
+    return [by_index[i] for i in sorted(by_index)]
+
+
+def interpolate_skipped_frames(frames_data):
+    """
+    Fill in comp frames skipped by strided tracking.
+    frames_data: per-frame results of the tracked frames, in frame order.
+    Centroid, bbox, area, luma and confidence are interpolated linearly and
+    the nearer tracked polygon is shifted along with the centroid. Motion
+    vectors become per-frame velocities. Next to a frame without a mask the
+    nearer tracked frame is copied instead.
+    """
+    if len(frames_data) < 2:
+        return frames_data
+
+    filled = [frames_data[0]]
+    for a, b in zip(frames_data, frames_data[1:]):
+        gap = b["frame_index"] - a["frame_index"]
+        if gap > 1:
+            b["motion_vector"] = [round(v / gap, 2) for v in b["motion_vector"]]
+            for k in range(1, gap):
+                t = k / float(gap)
+                if a["area"] > 0 and b["area"] > 0:
+                    frame = _lerp_frame_data(a, b, t)
+                else:
+                    frame = dict(a if t < 0.5 else b)
+                frame["frame_index"] = a["frame_index"] + k
+                frame["time"] = round(frame["frame_index"] / 30.0, 6)
+                frame["interpolated"] = True
+                filled.append(frame)
+        filled.append(b)
+
+    return filled
+
+
+def _lerp_frame_data(a, b, t):
+    """Blend two analysed frames; t in [0, 1] from a towards b."""
+    def lerp(x, y):
+        return x + (y - x) * t
+
+    centroid = [round(lerp(a["centroid"][i], b["centroid"][i]), 2) for i in range(2)]
+    near = a if t < 0.5 else b
+    dx = centroid[0] - near["centroid"][0]
+    dy = centroid[1] - near["centroid"][1]
+
+    return {
+        "centroid": centroid,
+        "bbox": [int(round(lerp(a["bbox"][i], b["bbox"][i]))) for i in range(4)],
+        "polygon": [[int(round(x + dx)), int(round(y + dy))] for x, y in near["polygon"]],
+        "area": int(round(lerp(a["area"], b["area"]))),
+        "avg_luma": round(lerp(a["avg_luma"], b["avg_luma"]), 4),
+        "motion_vector": list(b["motion_vector"]),
+        "confidence": lerp(a["confidence"], b["confidence"])
+    }
+
+
+class _RoiTrack(object):
+    """One object's state in ROI propagation."""
+
+    def __init__(self, mask):
+        self.mask = mask
+        self.bbox = mask.bbox if mask.area else None  # last non-empty bbox
+        self.velocity = (0.0, 0.0)
+        self.absent = 0
+
+    def predicted_box(self, shape):
+        """
+        Last bbox moved by the last frame-to-frame motion, clipped to the
+        frame; the whole frame until the object has had a non-empty mask.
+        """
+        h, w = shape
+        if self.bbox is None:
+            return [0, 0, w, h]
+        x0, y0, x1, y1 = self.bbox
+        dx, dy = self.velocity
+        return [min(max(x0 + dx, 0), w - 1), min(max(y0 + dy, 0), h - 1),
+                min(max(x1 + dx, 1), w), min(max(y1 + dy, 1), h)]
+
+    def update(self, mask):
+        if mask.area:
+            if self.mask.area:
+                (cx, cy), (px, py) = mask.centroid(), self.mask.centroid()
+                self.velocity = (cx - px, cy - py)
+            self.bbox = mask.bbox
+            self.absent = 0
+        else:
+            self.velocity = (0.0, 0.0)
+            self.absent += 1
+        self.mask = mask
+
+
+def _roi_window(box, margin, shape, min_side=64):
+    """
+    Square crop (x0, y0, x1, y1) around box, padded by margin times the box
+    size on each side, shifted to lie inside the frame. Square, because SAM2
+    resizes its input to a square without keeping the aspect ratio.
+    """
+    h, w = shape
+    side = max(box[2] - box[0], box[3] - box[1]) * (1.0 + 2.0 * margin)
+    side_x = int(round(min(max(side, min_side), w)))
+    side_y = int(round(min(max(side, min_side), h)))
+    x0 = int(round(min(max((box[0] + box[2] - side_x) / 2.0, 0), w - side_x)))
+    y0 = int(round(min(max((box[1] + box[3] - side_y) / 2.0, 0), h - side_y)))
+    return x0, y0, x0 + side_x, y0 + side_y
+
+
+def _roi_step(predictor, image, tracks, margin, min_score):
+    """
+    Segment every tracked object on one BGR frame. Each object gets a crop
+    around its predicted box, all crops go through the image encoder as one
+    batch, and the predicted box is the prompt. Objects whose crop result is
+    empty, unsure (score < min_score) or cut off by the crop edge, and
+    objects not seen yet, are segmented again on the full frame.
+    Returns {object_id: PackedMask}.
+    """
+    shape = image.shape[:2]
+    h, w = shape
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    boxes = {obj_id: track.predicted_box(shape) for obj_id, track in tracks.items()}
+    masks = {}
+    retry = [obj_id for obj_id, track in tracks.items() if track.bbox is None]
+
+    obj_ids = [obj_id for obj_id in tracks if obj_id not in retry]
+    if obj_ids:
+        windows = {obj_id: _roi_window(boxes[obj_id], margin, shape) for obj_id in obj_ids}
+        predictor.set_image_batch([rgb[y0:y1, x0:x1] for x0, y0, x1, y1 in (windows[i] for i in obj_ids)])
+        crop_boxes = []
+        for obj_id in obj_ids:
+            x0, y0 = windows[obj_id][:2]
+            bx0, by0, bx1, by1 = boxes[obj_id]
+            crop_boxes.append(np.array([bx0 - x0, by0 - y0, bx1 - x0, by1 - y0], dtype=np.float32))
+        crop_masks, crop_scores, _ = predictor.predict_batch(box_batch=crop_boxes, multimask_output=False)
+
+        for obj_id, crop, score in zip(obj_ids, crop_masks, crop_scores):
+            x0, y0, x1, y1 = windows[obj_id]
+            mask = PackedMask.from_crop(crop[0] > 0, (x0, y0), shape)
+            mx0, my0, mx1, my1 = mask.bbox
+            cut = ((mx0 == x0 and x0 > 0) or (my0 == y0 and y0 > 0) or
+                   (mx1 == x1 and x1 < w) or (my1 == y1 and y1 < h))
+            if not mask.area or float(score[0]) < min_score or cut:
+                retry.append(obj_id)
+            else:
+                masks[obj_id] = mask
+
+    if retry:
+        predictor.set_image(rgb)
+        full, _, _ = predictor.predict(box=np.array([boxes[i] for i in retry], dtype=np.float32),
+                                       multimask_output=False)
+        full = full.reshape(len(retry), -1, h, w)
+        for obj_id, mask in zip(retry, full):
+            masks[obj_id] = PackedMask.from_dense(mask[0] > 0)
+
+    return masks
+
+
+class _RoiSweep(object):
+    """
+    One sweep of ROI propagation (see _sweep): tracked objects are dropped
+    after stop_frames empty frames, never if stop_frames is 0.
+    """
+
+    def __init__(self, predictor, margin, min_score, stop_frames):
+        self.predictor = predictor
+        self.margin = margin
+        self.min_score = min_score
+        self.stop_frames = stop_frames
+        self.tracks = {}
+
+    def join(self, obj_id, mask):
+        self.tracks[obj_id] = _RoiTrack(mask)
+
+    def step(self, image, gray):
+        if not self.tracks or image is None:
+            return {}
+        with inference_context():
+            masks = _roi_step(self.predictor, image, self.tracks, self.margin, self.min_score)
+        for obj_id, mask in masks.items():
+            self.tracks[obj_id].update(mask)
+        if self.stop_frames:
+            self.tracks = {obj_id: t for obj_id, t in self.tracks.items() if t.absent < self.stop_frames}
+        return masks
+
+
+def _roi_propagate(frames, initial_masks, prompt_frames, options, progress, backward=True):
+    """
+    Propagation on crops around each object with the SAM2 image predictor,
+    for small subjects in large plates: each frame's search region comes
+    from the object's previous bbox and motion, and is segmented at model
+    resolution (see _roi_step). A lost object keeps being searched for
+    around its last position, on the full frame when the crop comes up empty.
+    The backward sweep drops an object after _ABSENT_STOP_FRAMES empty
+    frames, the forward sweep after exit_frames if set.
+    Yields (frame_idx, {object_id: PackedMask}).
+    """
+    predictor = get_sam2_image_predictor()
+    prefetch_depth = int(options.get("prefetch_depth", DEFAULT_PREFETCH_DEPTH))
+    margin = float(options.get("roi_margin", 0.5))
+    min_score = float(options.get("roi_min_score", 0.5))
+    exit_frames = int(options.get("exit_frames") or 0)
+
+    def new_sweep(reverse, start):
+        return _RoiSweep(predictor, margin, min_score, _ABSENT_STOP_FRAMES if reverse else exit_frames)
+
+    return _sweep(frames, initial_masks, prompt_frames, prefetch_depth, progress, backward, new_sweep)
+
+
+def _sweep(frames, initial_masks, prompt_frames, prefetch_depth, progress, backward, new_sweep):
+    """
+    Frame order, progress and prompt seeding shared by the frame-by-frame
+    propagations. Sweeps backward from the last prompt frame if backward is
+    set, buffering those masks until their frames come up, then forward;
+    each object joins at its prompt frame. new_sweep(reverse, start) makes
+    the per-sweep state, start being the frame the sweep continues from
+    (None going forward); its join(object_id, PackedMask) adds an object and
+    its step(image, gray) moves the joined objects onto the next frame,
+    returning {object_id: PackedMask}.
+    Yields (frame_idx, {object_id: PackedMask}).
+    """
+    packed = {obj_id: PackedMask.from_dense(mask) for obj_id, mask in initial_masks.items()}
+    joins = {}
+    for obj_id in packed:
+        joins.setdefault(prompt_frames.get(obj_id, 0), []).append(obj_id)
+
+    # Backward sweep, buffered until those frames come up
+    buffered = {}
+    last_prompt = max(joins)
+    if last_prompt > 0 and backward:
+        sweep = new_sweep(True, last_prompt)
+        for i, image, gray in prefetch(frames, range(last_prompt - 1, -1, -1), prefetch_depth):
+            progress.advance()
+            for obj_id in joins.get(i + 1, []):
+                sweep.join(obj_id, packed[obj_id])
+            masks = sweep.step(image, gray)
+            if masks:
+                buffered[i] = masks
+
+    # Forward sweep
+    sweep = new_sweep(False, None)
+    for i, image, gray in prefetch(frames, range(len(frames)), prefetch_depth):
+        progress.advance()
+        masks = sweep.step(image, gray)
+        for obj_id in joins.get(i, []):
+            sweep.join(obj_id, packed[obj_id])
+            masks[obj_id] = packed[obj_id]
+
+        out = buffered.pop(i, {})
+        out.update(masks)
+        yield i, out
+
+
 def _fallback_segment(image, click_points):
     """
     Fallback segmentation when SAM2 is not available.
@@ -355,53 +1515,71 @@ def _fallback_segment(image, click_points):
     return masks
 
 
-def _fallback_propagate(frame_paths, initial_masks, total_frames):
+class _FlowSweep(object):
     """
-    Fallback temporal propagation using optical flow.
+    One sweep of optical flow propagation (see _sweep). Going backward an
+    object drops out once its mask is empty and unreadable frames are
+    skipped; going forward unreadable frames repeat the previous masks.
     """
-    all_masks = {}
-    for obj_id in initial_masks:
-        all_masks[obj_id] = [None] * total_frames
-        all_masks[obj_id][0] = initial_masks[obj_id]
 
-    prev_gray = cv2.imread(frame_paths[0], cv2.IMREAD_GRAYSCALE)
+    def __init__(self, reverse, gray):
+        self.reverse = reverse
+        self.gray = gray
+        self.masks = {}
 
-    for i in range(1, total_frames):
-        print("PROGRESS:{}/{}".format(i + 1, total_frames), flush=True)
+    def join(self, obj_id, mask):
+        self.masks[obj_id] = mask
 
-        curr_gray = cv2.imread(frame_paths[i], cv2.IMREAD_GRAYSCALE)
-        if curr_gray is None:
-            # Copy previous masks
-            for obj_id in all_masks:
-                all_masks[obj_id][i] = all_masks[obj_id][i - 1]
-            continue
-
-        # Compute dense optical flow
-        flow = cv2.calcOpticalFlowFarneback(
-            prev_gray, curr_gray, None,
-            pyr_scale=0.5, levels=3, winsize=15,
-            iterations=3, poly_n=5, poly_sigma=1.2, flags=0
-        )
+    def step(self, image, gray):
+        if gray is None:
+            return {} if self.reverse else dict(self.masks)
+        if self.masks:
+            masks = _flow_warp(self.gray, gray, self.masks)
+            if self.reverse:
+                masks = {obj_id: mask for obj_id, mask in masks.items() if mask.area}
+            self.masks = masks
+        self.gray = gray
+        return dict(self.masks)
 
-        h, w = prev_gray.shape
-        # Create remap grids
-        grid_y, grid_x = np.mgrid[0:h, 0:w].astype(np.float32)
-        map_x = grid_x + flow[:, :, 0]
-        map_y = grid_y + flow[:, :, 1]
-
-        for obj_id in all_masks:
-            prev_mask = all_masks[obj_id][i - 1]
-            if prev_mask is None:
-                all_masks[obj_id][i] = np.zeros((h, w), dtype=np.uint8)
-                continue
 
-            # Warp mask with optical flow
-            warped = cv2.remap(
-                prev_mask.astype(np.float32), map_x, map_y,
-                cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0
-            )
-            all_masks[obj_id][i] = (warped > 0.5).astype(np.uint8)
+def _fallback_propagate(frames, initial_masks, prompt_frames, prefetch_depth, progress, backward=True):
+    """
+    Fallback temporal propagation using optical flow, swept backward and
+    forward from the prompt frames (see _sweep).
+    Yields (frame_idx, {object_id: PackedMask}); only the previous frame's masks are kept.
+    """
+    def new_sweep(reverse, start):
+        return _FlowSweep(reverse, frames.luma(start) if start is not None else None)
+
+    return _sweep(frames, initial_masks, prompt_frames, prefetch_depth, progress, backward, new_sweep)
+
+
+def _flow_warp(prev_gray, curr_gray, masks):
+    """Warp PackedMasks from prev_gray's frame onto curr_gray's with dense optical flow."""
+    # Compute dense optical flow
+    flow = cv2.calcOpticalFlowFarneback(
+        prev_gray, curr_gray, None,
+        pyr_scale=0.5, levels=3, winsize=15,
+        iterations=3, poly_n=5, poly_sigma=1.2, flags=0
+    )
+
+    h, w = prev_gray.shape
+    # Create remap grids
+    grid_y, grid_x = np.mgrid[0:h, 0:w].astype(np.float32)
+    map_x = grid_x + flow[:, :, 0]
+    map_y = grid_y + flow[:, :, 1]
+
+    warped_masks = {}
+    for obj_id, mask in masks.items():
+        if not mask.area:
+            warped_masks[obj_id] = PackedMask.empty((h, w))
+            continue
 
-        prev_gray = curr_gray
+        # Warp mask with optical flow
+        warped = cv2.remap(
+            mask.decode().astype(np.float32), map_x, map_y,
+            cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0
+        )
+        warped_masks[obj_id] = PackedMask.from_dense(warped > 0.5)
 
-    return all_masks
+    return warped_masks